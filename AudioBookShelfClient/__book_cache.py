@@ -1,21 +1,25 @@
-from typing import List, Dict, Any, Optional
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
 
 import duckdb
-import pandas as pd
 
+from .__expanded import ExpandedItems
 from .__rest_client import RestClient, RestException
+from .__schema import BookSchema
 
 class DataException(Exception):
     def __init__(self, message):
         self.message = message
 
 class BookCache:
-    def __init__(self, library_id: str, url: str, api_key: str):
+    def __init__(self, library_id: str, url: str, api_key: str, snapshot: Optional[Path] = None):
         """
         Initialize BookCache and load books from the API.
 
         Args:
             library_id: ID of the library to fetch books from
+            snapshot: Load the books from this snapshot file instead of the API
 
         Raises:
             ValueError: If library_id is not provided or an API request fails
@@ -24,9 +28,25 @@ class BookCache:
         self.base_url = url
         self.api_key = api_key
         self.genres_cache = None
+        self.library_id = library_id
 
         self.conn = duckdb.connect(':memory:', read_only=False)
-        self._load_books(library_id)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        if snapshot:
+            self._load_snapshot(snapshot)
+        else:
+            self._load_books(library_id)
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """
+        Cursor for the calling thread, so concurrent readers don't share a connection.
+        """
+        cursor = getattr(self.local, 'cursor', None)
+        if cursor is None:
+            cursor = self.conn.cursor()
+            self.local.cursor = cursor
+        return cursor
 
     def _load_books(self, library_id: str):
         """Fetch books from API and load into DuckDB."""
@@ -48,23 +68,73 @@ class BookCache:
             # Create an empty table with schema
             raise DataException("No books found")
         else:
-            con = self.conn
-            df = pd.json_normalize(books_list)
-            con.register("books_list_df", df)
-            # Let DuckDB infer schema from the book data
-            con.execute("""
-                  CREATE TABLE books AS
-                  SELECT * 
-                  FROM books_list_df
+            df = BookSchema.to_dataframe(books_list)
+            # Typed table from the declared schema, unknown fields end up in the 'extra' JSON column
+            BookSchema.create_table(self.conn, df)
+
+    def _load_snapshot(self, path: Path):
+        """Load books from a Parquet snapshot written by Snapshots.save."""
+        literal = "'" + str(path).replace("'", "''") + "'"
+        try:
+            self.conn.execute(f"""
+                CREATE TABLE books AS
+                SELECT * EXCLUDE ({BookSchema.HASH_COLUMN}) FROM read_parquet({literal})
             """)
-        #print(self.conn.execute("DESCRIBE books").fetchdf())
+        except duckdb.Error as e:
+            raise ValueError(f"Can't read snapshot '{path}': {e}")
+        if self.count() == 0:
+            raise DataException("No books found")
+
+    def expand(self, concurrency: int = 8) -> Tuple[int, int]:
+        """
+        Load the chapters, audio_files and tracks tables, see ExpandedItems.
+
+        Returns:
+            Number of books fetched and number of books taken from the cache
+        """
+        with self.lock:
+            return ExpandedItems(self.conn, self.library_id, self.base_url, self.api_key).sync(concurrency)
+
+    def apply_delta(self, changed: List[Dict[str, Any]], removed: Optional[List[str]] = None):
+        """
+        Replace the rows of changed books with the given API results and drop removed books.
+
+        Args:
+            changed: Library items as returned by the API, new or updated
+            removed: IDs of books that no longer exist
+        """
+        ids = [item.get('id') for item in changed] + list(removed or [])
+        if not ids:
+            return
+        with self.lock:
+            self.conn.execute("DELETE FROM books WHERE id IN (SELECT UNNEST(?::VARCHAR[]))", [ids])
+            if changed:
+                BookSchema.insert_rows(self.conn, BookSchema.to_dataframe(changed))
+
+    def watermark(self) -> Optional[int]:
+        """The most recent updatedAt of any book, in milliseconds since the epoch."""
+        return self.cursor().execute("SELECT epoch_ms(MAX(updatedAt)) FROM books").fetchone()[0]
+
+    def get_ids(self) -> List[str]:
+        return [row[0] for row in self.cursor().execute("SELECT id FROM books").fetchall()]
 
     def get_columns(self) -> Optional[List[str]]:
-        cols = self.conn.execute("DESCRIBE books").fetchdf()
+        cols = self.cursor().execute("DESCRIBE books").fetchdf()
         return [item.get('column_name') for item in cols.to_dict(orient='records')]
 
+    def get_by_ids(self, ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Get books by ID, in the order of the given ids. Unknown ids are skipped.
+        """
+        if not ids:
+            return []
+        rows = self.cursor().execute("SELECT * FROM books WHERE id IN (SELECT UNNEST(?::VARCHAR[]))", [ids])
+        columns = [desc[0] for desc in rows.description]
+        found = {row['id']: row for row in (dict(zip(columns, item)) for item in rows.fetchall())}
+        return [found[book_id] for book_id in ids if book_id in found]
+
     def count(self) -> int:
-        return self.conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        return self.cursor().execute("SELECT COUNT(*) FROM books").fetchone()[0]
 
     def query(self, sql: str) -> List[Dict[str, Any]]:
         """
@@ -76,8 +146,9 @@ class BookCache:
         Returns:
             List of dictionaries containing query results
         """
-        result = self.conn.execute(sql).fetchall()
-        columns = [desc[0] for desc in self.conn.description]
+        cursor = self.cursor()
+        result = cursor.execute(sql).fetchall()
+        columns = [desc[0] for desc in cursor.description]
         return [dict(zip(columns, row)) for row in result]
 
     def get_all(self) -> List[Dict[str, Any]]:
@@ -99,7 +170,7 @@ class BookCache:
         Returns:
             Dictionary containing book data or None if not found
         """
-        result = self.conn.execute(
+        result = self.cursor().execute(
             "SELECT * FROM books WHERE id = ?",
             [book_id]
         ).fetchone()
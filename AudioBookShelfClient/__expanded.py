@@ -0,0 +1,239 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import duckdb
+import pandas as pd
+
+from .__rest_client import RestClient, RestException
+from .utils import Utils
+
+
+class ExpandedItems:
+    """
+    Chapters, audio files and tracks of a library's books, in tables joinable to books on
+    book_id = books.id.
+
+    Only the summary counts are part of the library items list, so the details come from the
+    expanded items: in chunks from /api/items/batch/get, or one by one from /api/items/{id} when
+    the batch endpoint doesn't return expanded items. They are cached per library as Parquet,
+    with the updatedAt of every book, so only new and changed books are fetched again.
+    """
+
+    TABLES: Dict[str, Dict[str, str]] = {
+        'chapters': {
+            'book_id': 'VARCHAR',
+            'id': 'INTEGER',
+            'start': 'DOUBLE',
+            'end': 'DOUBLE',
+            'duration': 'DOUBLE',
+            'title': 'VARCHAR',
+        },
+        'audio_files': {
+            'book_id': 'VARCHAR',
+            'index': 'INTEGER',
+            'ino': 'VARCHAR',
+            'filename': 'VARCHAR',
+            'duration': 'DOUBLE',
+            'bitRate': 'INTEGER',
+            'codec': 'VARCHAR',
+            'format': 'VARCHAR',
+            'channels': 'INTEGER',
+            'channelLayout': 'VARCHAR',
+            'size': 'BIGINT',
+            'mimeType': 'VARCHAR',
+            'language': 'VARCHAR',
+        },
+        'tracks': {
+            'book_id': 'VARCHAR',
+            'index': 'INTEGER',
+            'startOffset': 'DOUBLE',
+            'duration': 'DOUBLE',
+            'title': 'VARCHAR',
+            'mimeType': 'VARCHAR',
+            'codec': 'VARCHAR',
+        },
+    }
+
+    # Macros returning a book's rows of each table as a list of structs, e.g.
+    # len(list_filter(book_chapters(id), c -> c.duration > 7200)) > 0, so where clauses can use the
+    # tables without subqueries. The rows are selected through a derived table, which keeps the
+    # macro's argument (usually the books' id) from binding to a column of the table itself.
+    MACROS: Dict[str, Tuple[str, str]] = {
+        'book_chapters': ('chapters', 'start'),
+        'book_audio_files': ('audio_files', 'index'),
+        'book_tracks': ('tracks', 'index'),
+    }
+
+    # The updatedAt of each book the tables hold details of
+    ITEMS_TABLE = 'expanded_items'
+
+    BATCH_SIZE = 50
+
+    def __init__(self, conn: duckdb.DuckDBPyConnection, library_id: str, url: str, api_key: str,
+                 cache_path: Optional[Path] = None):
+        self.conn = conn
+        self.library_id = library_id
+        self.base_url = url
+        self.api_key = api_key
+        self.cache_path = cache_path or Utils.cache_dir('expanded', library_id)
+        self.batch_supported = True
+
+    @staticmethod
+    def rows(item: Dict[str, Any]) -> Dict[str, List[Tuple]]:
+        """The rows of each table for one expanded library item."""
+        book_id = item['id']
+        media = item.get('media') or {}
+
+        chapters = []
+        for i, chapter in enumerate(media.get('chapters') or []):
+            start, end = chapter.get('start'), chapter.get('end')
+            duration = end - start if start is not None and end is not None else None
+            chapters.append((book_id, chapter.get('id', i), start, end, duration, chapter.get('title')))
+
+        audio_files = []
+        for audio_file in media.get('audioFiles') or []:
+            metadata = audio_file.get('metadata') or {}
+            audio_files.append((book_id, audio_file.get('index'), audio_file.get('ino'), metadata.get('filename'),
+                                audio_file.get('duration'), audio_file.get('bitRate'), audio_file.get('codec'),
+                                audio_file.get('format'), audio_file.get('channels'), audio_file.get('channelLayout'),
+                                metadata.get('size'), audio_file.get('mimeType'), audio_file.get('language')))
+
+        tracks = [(book_id, track.get('index'), track.get('startOffset'), track.get('duration'), track.get('title'),
+                   track.get('mimeType'), track.get('codec'))
+                  for track in media.get('tracks') or []]
+
+        return {'chapters': chapters, 'audio_files': audio_files, 'tracks': tracks}
+
+    @staticmethod
+    def __literal(path: Path) -> str:
+        return "'" + str(path).replace("'", "''") + "'"
+
+    def __create_tables(self):
+        tables = {**self.TABLES, self.ITEMS_TABLE: {'id': 'VARCHAR', 'updatedAt': 'TIMESTAMP'}}
+        for table, columns in tables.items():
+            definition = ', '.join(f'"{name}" {sql_type}' for name, sql_type in columns.items())
+            self.conn.execute(f'CREATE OR REPLACE TABLE "{table}" ({definition})')
+
+        for macro, (table, order) in self.MACROS.items():
+            self.conn.execute(f"""
+                CREATE OR REPLACE MACRO {macro}(book) AS (
+                    SELECT COALESCE(list(__row ORDER BY __order), [])
+                    FROM (SELECT book_id AS __book, "{order}" AS __order, "{table}" AS __row FROM "{table}")
+                    WHERE __book = book
+                )
+            """)
+
+        try:
+            for table in tables:
+                cached = self.cache_path / f"{table}.parquet"
+                if cached.exists():
+                    self.conn.execute(f'INSERT INTO "{table}" BY NAME SELECT * FROM read_parquet({self.__literal(cached)})')
+        except duckdb.Error:
+            # Unreadable or from an older layout, everything is fetched again
+            for table in tables:
+                self.conn.execute(f'DELETE FROM "{table}"')
+
+    def __fetch_batch(self, ids: List[str]) -> Optional[List[Dict[str, Any]]]:
+        url = f"{self.base_url.rstrip('/')}/api/items/batch/get"
+        try:
+            response = RestClient.post(url, self.api_key, payload={'libraryItemIds': ids})
+        except RestException as e:
+            if e.status_code == 404:
+                return None
+            raise
+        items = (response or {}).get('libraryItems')
+        # Older servers return the items without chapters and audio files
+        if not isinstance(items, list) or any('chapters' not in (item.get('media') or {}) for item in items):
+            return None
+        return items
+
+    def __fetch_item(self, book_id: str) -> Optional[Dict[str, Any]]:
+        url = f"{self.base_url.rstrip('/')}/api/items/{book_id}"
+        try:
+            return RestClient.get(url, self.api_key, params={'expanded': 1})
+        except RestException as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    def __fetch(self, ids: List[str], concurrency: int) -> List[Dict[str, Any]]:
+        chunks = [ids[i:i + self.BATCH_SIZE] for i in range(0, len(ids), self.BATCH_SIZE)]
+
+        def fetch_chunk(chunk: List[str]) -> List[Dict[str, Any]]:
+            if self.batch_supported:
+                items = self.__fetch_batch(chunk)
+                if items is not None:
+                    return items
+                self.batch_supported = False
+            return [item for item in (self.__fetch_item(book_id) for book_id in chunk) if item]
+
+        # The first chunk finds out whether the batch endpoint can be used
+        items = fetch_chunk(chunks[0]) if chunks else []
+        remaining = chunks[1:]
+        if not self.batch_supported:
+            remaining = [[book_id] for chunk in remaining for book_id in chunk]
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, fetch_chunk, chunk) for chunk in remaining]
+            for future in futures:
+                items += future.result()
+        return items
+
+    def __save(self):
+        for table in [*self.TABLES, self.ITEMS_TABLE]:
+            target = self.cache_path / f"{table}.parquet"
+            tmp = target.with_suffix(f".{os.getpid()}.tmp")
+            try:
+                self.conn.execute(f'COPY "{table}" TO {self.__literal(tmp)} (FORMAT PARQUET, COMPRESSION ZSTD)')
+                os.replace(tmp, target)
+            except (OSError, duckdb.Error):
+                tmp.unlink(missing_ok=True)
+
+    def sync(self, concurrency: int = 8) -> Tuple[int, int]:
+        """
+        Load the tables for the books in the books table, fetching the details of books that are
+        new or changed since they were cached.
+
+        Returns:
+            Number of books fetched and number of books taken from the cache
+        """
+        self.__create_tables()
+
+        stale = [row[0] for row in self.conn.execute(f"""
+            SELECT b.id FROM books b LEFT JOIN "{self.ITEMS_TABLE}" e ON b.id = e.id
+            WHERE e."updatedAt" IS DISTINCT FROM b."updatedAt"
+        """).fetchall()]
+        removed = [row[0] for row in self.conn.execute(f"""
+            SELECT id FROM "{self.ITEMS_TABLE}" ANTI JOIN books USING (id)
+        """).fetchall()]
+        if not stale and not removed:
+            return 0, self.conn.execute(f'SELECT COUNT(*) FROM "{self.ITEMS_TABLE}"').fetchone()[0]
+
+        items = self.__fetch(stale, concurrency)
+
+        for table in [*self.TABLES, self.ITEMS_TABLE]:
+            self.conn.execute(f"""DELETE FROM "{table}" WHERE {'book_id' if table in self.TABLES else 'id'} IN (SELECT UNNEST(?::VARCHAR[]))""",
+                              [stale + removed])
+
+        rows: Dict[str, List[Tuple]] = {table: [] for table in self.TABLES}
+        for item in items:
+            for table, table_rows in self.rows(item).items():
+                rows[table] += table_rows
+        for table, table_rows in rows.items():
+            if table_rows:
+                df = pd.DataFrame(table_rows, columns=list(self.TABLES[table]), dtype=object)
+                self.conn.execute(f'INSERT INTO "{table}" SELECT * FROM df')
+
+        # Books are recorded with the updatedAt of the books table, which the items were fetched for
+        fetched = [item['id'] for item in items]
+        self.conn.execute(f"""
+            INSERT INTO "{self.ITEMS_TABLE}"
+            SELECT id, "updatedAt" FROM books WHERE id IN (SELECT UNNEST(?::VARCHAR[]))
+        """, [fetched])
+
+        self.__save()
+        cached = self.conn.execute(f'SELECT COUNT(*) FROM "{self.ITEMS_TABLE}"').fetchone()[0] - len(fetched)
+        return len(fetched), cached
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from .utils import Utils
+
+
+class HttpCacheEntry:
+    def __init__(self, body: bytes, etag: Optional[str], last_modified: Optional[str], fetched: float):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    On-disk store of GET response bodies and their validators (ETag / Last-Modified).
+
+    Entries are keyed by URL, query parameters and a hash of the API key, so different users of
+    the same server never see each other's responses.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or Utils.cache_dir('http')
+
+    def __key(self, url: str, api_key: str, params: Optional[Dict[str, Any]]) -> str:
+        key = json.dumps([url, sorted((params or {}).items()), hashlib.sha256(api_key.encode('utf-8')).hexdigest()], default=str)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def load(self, url: str, api_key: str, params: Optional[Dict[str, Any]] = None) -> Optional[HttpCacheEntry]:
+        key = self.__key(url, api_key, params)
+        try:
+            with open(self.path / f"{key}.json", 'r') as f:
+                meta = json.load(f)
+            with open(self.path / f"{key}.body", 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return HttpCacheEntry(body, meta.get('etag'), meta.get('last_modified'), meta.get('fetched', 0))
+
+    def store(self, url: str, api_key: str, params: Optional[Dict[str, Any]], body: bytes,
+              etag: Optional[str], last_modified: Optional[str]):
+        if not etag and not last_modified:
+            return
+        key = self.__key(url, api_key, params)
+        meta = {'url': url, 'etag': etag, 'last_modified': last_modified, 'fetched': time.time()}
+        try:
+            self.__write(self.path / f"{key}.body", body)
+            self.__write(self.path / f"{key}.json", json.dumps(meta).encode('utf-8'))
+        except OSError:
+            pass
+
+    def touch(self, url: str, api_key: str, params: Optional[Dict[str, Any]] = None):
+        """Mark an entry as freshly validated after a 304 response."""
+        key = self.__key(url, api_key, params)
+        try:
+            with open(self.path / f"{key}.json", 'r') as f:
+                meta = json.load(f)
+            meta['fetched'] = time.time()
+            self.__write(self.path / f"{key}.json", json.dumps(meta).encode('utf-8'))
+        except (OSError, ValueError):
+            pass
+
+    def clear(self):
+        for entry in self.path.iterdir():
+            entry.unlink(missing_ok=True)
+
+    @staticmethod
+    def __write(path: Path, data: bytes):
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
@@ -2,9 +2,19 @@
 from .config import Config
 from .libraries import Libraries, Library
 from .utils import Utils
-from .collections import Collections
+from .collections import Collections, Collection, CollectionBook
 from .books import Books, NoBooksException
 from .series import Series
-from .filters import Filters
+from .filters import Filters, FilterData
+from .session import Session
+from .daemon import Daemon
+from .watch import Watcher
+from .items import Items
+from .stats import Stats
+from .dupes import Duplicates
+from .snapshots import Snapshots
+from .journal import Journal
+from .__rest_client import RestClient
+from .__json import JsonDecoder
 
-__all__ = ['Config', 'Libraries', 'Utils', 'Books', 'Collections', 'Series', 'Filters', 'Library', 'NoBooksException']
\ No newline at end of file
+__all__ = ['Config', 'Libraries', 'Utils', 'Books', 'Collections', 'Series', 'Filters', 'Library', 'NoBooksException', 'Session', 'Daemon', 'Watcher', 'RestClient', 'Items', 'Stats', 'Duplicates', 'Collection', 'CollectionBook', 'FilterData', 'JsonDecoder', 'Snapshots', 'Journal']
\ No newline at end of file
@@ -0,0 +1,107 @@
+import importlib
+import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Callable, TypeVar
+
+T = TypeVar('T')
+
+
+class JsonDecoder:
+    """
+    Parses JSON straight from response bytes with the fastest installed backend: msgspec, then
+    orjson, then the standard library.
+
+    With msgspec, typed endpoints are decoded against a TypedDict schema, which validates the
+    response and skips every field the schema doesn't declare instead of building it first.
+    """
+
+    BACKENDS = ['msgspec', 'orjson', 'json']
+
+    backend: Optional[str] = None
+    __module = None
+    # Shared by the threads a command hands its context to, see Session.prefetch
+    __stats: ContextVar[Dict[str, Any]] = ContextVar('json_stats')
+    __lock = threading.Lock()
+
+    @staticmethod
+    def select(name: Optional[str] = None) -> str:
+        """
+        Choose the backend. 'auto' or None picks the first installed one from BACKENDS.
+        """
+        if name in (None, 'auto'):
+            for candidate in JsonDecoder.BACKENDS:
+                try:
+                    JsonDecoder.__module = importlib.import_module(candidate)
+                except ImportError:
+                    continue
+                JsonDecoder.backend = candidate
+                return candidate
+
+        if name not in JsonDecoder.BACKENDS:
+            raise ValueError(f"Unknown JSON backend '{name}', use one of: auto, {', '.join(JsonDecoder.BACKENDS)}")
+        try:
+            JsonDecoder.__module = importlib.import_module(name)
+        except ImportError:
+            raise ValueError(f"JSON backend '{name}' is not installed")
+        JsonDecoder.backend = name
+        return name
+
+    @staticmethod
+    def __parse(data: bytes, schema: Optional[type] = None) -> Any:
+        if JsonDecoder.backend is None:
+            JsonDecoder.select()
+        module = JsonDecoder.__module
+        # A response that doesn't match the schema, which msgspec reports as a ValueError as well
+        validation_error = module.ValidationError if JsonDecoder.backend == 'msgspec' else ()
+
+        started = time.perf_counter()
+        try:
+            if JsonDecoder.backend == 'orjson':
+                result = module.loads(data)
+            elif JsonDecoder.backend == 'msgspec':
+                result = module.json.decode(data, type=schema) if schema is not None else module.json.decode(data)
+            else:
+                result = json.loads(data)
+        except validation_error as e:
+            # e.g. "Expected `str`, got `int` - at `$.results[0].name`"
+            raise ValueError(f"Unexpected response from server: {e}")
+        except ValueError:
+            # The JSON decode errors of all backends are ValueErrors
+            raise ValueError("Invalid JSON response from server")
+
+        stats = JsonDecoder.stats()
+        with JsonDecoder.__lock:
+            stats['responses'] += 1
+            stats['bytes'] += len(data)
+            stats['seconds'] += time.perf_counter() - started
+        return result
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        return JsonDecoder.__parse(data)
+
+    @staticmethod
+    def decode(data: bytes, model: Callable[[Any], T], schema: Optional[type] = None) -> T:
+        """
+        Decode a response and build a typed model from it.
+
+        :param model: Called with the decoded JSON, e.g. a model's from_json
+        :param schema: TypedDict describing the fields the model uses, applied when msgspec is the backend
+        """
+        return model(JsonDecoder.__parse(data, schema))
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        """Responses, bytes and seconds spent decoding in the current context."""
+        stats = JsonDecoder.__stats.get(None)
+        if stats is None:
+            stats = JsonDecoder.reset_stats()
+        return stats
+
+    @staticmethod
+    def reset_stats() -> Dict[str, Any]:
+        stats = {'responses': 0, 'bytes': 0, 'seconds': 0.0}
+        JsonDecoder.__stats.set(stats)
+        return stats
@@ -1,11 +1,17 @@
-import json
-from types import SimpleNamespace
+import time
 
 import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, TypeVar
 
 from requests import Response
 
+from .__http_cache import HttpCache
+from .__json import JsonDecoder
+from .__throttle import Throttle
+
+
+T = TypeVar('T')
+
 
 class RestException(Exception):
     def __init__(self, message, status_code):
@@ -14,19 +20,85 @@ class RestException(Exception):
 
 class RestClient:
 
+    # Seconds a cached response is used without asking the server, per endpoint.  Older responses
+    # are revalidated with If-None-Match / If-Modified-Since.
+    MAX_AGE = {
+        'libraries': 300,
+        'collections': 0,
+        'filterdata': 0,
+    }
+
+    # Created on first use, so importing the module doesn't create the cache directory
+    http_cache: Optional[HttpCache] = None
+    http_cache_enabled = True
+    throttle: Throttle = Throttle()
+    # The settings the throttle was built from. It is shared by every command a process (e.g. the
+    # daemon) runs, so it is only rebuilt when they change
+    throttle_settings: Dict[str, Any] = Throttle.settings_of(None)
+    max_retries = 5
+    # No requests are made while offline, cached responses are used regardless of their age
+    offline = False
+
     @staticmethod
-    def __get(url: str, api_key: str, headers=None, params=None, payload=None) -> Optional[Response]:
+    def configure(http_cache: Optional[Dict[str, Any]] = None, rate_limit: Optional[Dict[str, Any]] = None,
+                  json_backend: Optional[str] = None, offline: bool = False):
+        """
+        Apply the 'http_cache', 'rate_limit' and 'json_backend' settings of a server config:
+            "http_cache": {"enabled": true, "max_age": {"libraries": 300, "collections": 0, "filterdata": 0}}
+            "rate_limit": {"requests_per_second": 20, "burst": 20, "max_concurrency": 8, "max_retries": 5}
+            "json_backend": "auto"
+        """
+        JsonDecoder.select(json_backend)
+        RestClient.offline = offline
+
+        http_cache = http_cache or {}
+        RestClient.http_cache_enabled = http_cache.get('enabled', True)
+        if not RestClient.http_cache_enabled:
+            RestClient.http_cache = None
+        RestClient.MAX_AGE.update(http_cache.get('max_age') or {})
+
+        rate_limit = rate_limit or {}
+        throttle_settings = Throttle.settings_of(rate_limit)
+        if throttle_settings != RestClient.throttle_settings:
+            RestClient.throttle = Throttle.from_settings(throttle_settings)
+            RestClient.throttle_settings = throttle_settings
+        RestClient.max_retries = rate_limit.get('max_retries', RestClient.max_retries)
+
+    @staticmethod
+    def __http_cache() -> Optional[HttpCache]:
+        if RestClient.http_cache is None and RestClient.http_cache_enabled:
+            RestClient.http_cache = HttpCache()
+        return RestClient.http_cache
+
+    @staticmethod
+    def __retry_delay(response: Response, attempt: int) -> float:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), 60.0)
+            except ValueError:
+                pass
+        return min(0.5 * (2 ** attempt), 30.0)
+
+    @staticmethod
+    def __request(method: str, url: str, api_key: str, headers=None, params=None, payload=None) -> Optional[Response]:
         """
-        Make a GET request to the AudioBookShelf API.
+        Make a request to the AudioBookShelf API through the shared throttle.
+
+        429 and 503 responses slow the throttle down and are retried (honouring Retry-After) up to
+        max_retries times before they are reported.
 
+        :param method: The HTTP method
         :param url: The URL to request
         :param api_key: The API key to use for authentication
         :param headers: Optional headers
         :param params: Optional query parameters
         :param payload: Optional JSON payload
-        :param raw: If True, return the raw response object instead of parsing JSON
-        :return: Response data
+        :return: The response
         """
+        if RestClient.offline:
+            raise ValueError(f"Running offline, can't request {url}")
+
         my_headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
@@ -34,10 +106,21 @@ class RestClient:
         if headers:
             my_headers.update(headers)
 
+        throttle = RestClient.throttle
+        attempt = 0
         try:
-            response = requests.get(url, headers=my_headers, params=params, json=payload, timeout=30)
-            response.raise_for_status()
-            return response
+            while True:
+                with throttle.slot():
+                    response = requests.request(method, url, headers=my_headers, params=params, json=payload, timeout=30)
+                if response.status_code in (429, 503) and attempt < RestClient.max_retries:
+                    throttle.overloaded()
+                    time.sleep(RestClient.__retry_delay(response, attempt))
+                    attempt += 1
+                    continue
+                if response.status_code < 400:
+                    throttle.success(response.elapsed.total_seconds(), Throttle.endpoint(method, url))
+                response.raise_for_status()
+                return response
 
         except requests.exceptions.HTTPError as e:
             if response.status_code == 401:
@@ -56,13 +139,15 @@ class RestClient:
                 raise ValueError("Service unavailable. Please try again later.")
             else:
                 raise requests.exceptions.HTTPError(f"HTTP error occurred: {e}")
-        except requests.exceptions.JSONDecodeError:
-            raise ValueError("Invalid JSON response from server")
         except requests.exceptions.Timeout:
             raise requests.exceptions.Timeout("Request timed out after 30 seconds")
         except requests.exceptions.RequestException as e:
             raise requests.exceptions.RequestException(f"Request failed: {e}")
 
+    @staticmethod
+    def __get(url: str, api_key: str, headers=None, params=None, payload=None) -> Optional[Response]:
+        return RestClient.__request("GET", url, api_key, headers, params, payload)
+
     @staticmethod
     def get_raw(url, api_key, headers=None, params=None, payload=None) -> Optional[Response]:
         return RestClient.__get(url, api_key, headers, params, payload)
@@ -70,7 +155,40 @@ class RestClient:
     @staticmethod
     def get(url, api_key, headers=None, params=None, payload=None) -> Optional[Dict[str, Any]]:
         response = RestClient.__get(url, api_key, headers, params, payload)
-        return response.json()
+        return JsonDecoder.loads(response.content)
+
+    @staticmethod
+    def get_cached(url, api_key, endpoint: str, params=None, max_age: Optional[int] = None) -> bytes:
+        """
+        GET a response body through the on-disk HTTP cache.
+
+        A cached body younger than the endpoint's max age is returned without a request, otherwise
+        the request is made conditional on the cached validators and a 304 is served from disk.
+
+        :param url: The URL to request
+        :param api_key: The API key to use for authentication
+        :param endpoint: Name of the endpoint in MAX_AGE
+        :param params: Optional query parameters
+        :param max_age: Overrides the endpoint's max age, 0 always revalidates
+        :return: Response body
+        """
+        cache = RestClient.__http_cache()
+        if cache is None:
+            return RestClient.__get(url, api_key, params=params).content
+
+        if max_age is None:
+            max_age = RestClient.MAX_AGE.get(endpoint, 0)
+        entry = cache.load(url, api_key, params)
+        if entry and (entry.age < max_age or RestClient.offline):
+            return entry.body
+
+        response = RestClient.__get(url, api_key, headers=entry.validators() if entry else None, params=params)
+        if response.status_code == 304 and entry:
+            cache.touch(url, api_key, params)
+            return entry.body
+
+        cache.store(url, api_key, params, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.content
 
     @staticmethod
     def get_text(url, api_key, headers=None, params=None, payload=None) -> Optional[str]:
@@ -78,9 +196,15 @@ class RestClient:
         return response.text
 
     @staticmethod
-    def get_auto(url, api_key, headers=None, params=None, payload=None) -> Optional[Any]:
+    def get_auto(url, api_key, model: Callable[[Any], T], schema: Optional[type] = None, headers=None, params=None, payload=None) -> Optional[T]:
+        """
+        GET a JSON response and build a typed model from it.
+
+        :param model: Called with the decoded JSON, e.g. a model's from_json
+        :param schema: Optional TypedDict of the fields the model uses, see JsonDecoder.decode
+        """
         response = RestClient.__get(url, api_key, headers, params, payload)
-        return json.loads(response.text, object_hook=lambda d: SimpleNamespace(**d))
+        return JsonDecoder.decode(response.content, model, schema)
 
     @staticmethod
     def post(url, api_key, headers=None, payload=None) -> Optional[Dict[str, Any]]:
@@ -93,43 +217,8 @@ class RestClient:
         :param payload: Optional JSON payload
         :return: Response data
         """
-
-        my_headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        if headers:
-            my_headers.update(headers)
-
-        try:
-            response = requests.post(url, headers=my_headers, json=payload, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            return data
-
-        except requests.exceptions.HTTPError as e:
-            if response.status_code == 401:
-                raise ValueError("Authentication failed. Check your API key")
-            elif response.status_code == 403:
-                raise ValueError("Access forbidden. Check your permissions")
-            elif response.status_code == 404:
-                raise RestException("404", 404)
-            elif response.status_code == 400:
-                raise ValueError(f"Bad request: {response.text}")
-            elif response.status_code == 429:
-                raise ValueError("Too many requests. Please try again later.")
-            elif response.status_code == 500:
-                raise ValueError("Internal server error. Please try again later.")
-            elif response.status_code == 503:
-                raise ValueError("Service unavailable. Please try again later.")
-            else:
-                raise requests.exceptions.HTTPError(f"HTTP error occurred: {e}")
-        except requests.exceptions.JSONDecodeError:
-            raise ValueError("Invalid JSON response from server")
-        except requests.exceptions.Timeout:
-            raise requests.exceptions.Timeout("Request timed out after 30 seconds")
-        except requests.exceptions.RequestException as e:
-            raise requests.exceptions.RequestException(f"Request failed: {e}")
+        response = RestClient.__request("POST", url, api_key, headers, payload=payload)
+        return JsonDecoder.loads(response.content)
 
     @staticmethod
     def patch(url, api_key, headers=None, payload=None) -> Optional[Dict[str, Any]]:
@@ -142,40 +231,5 @@ class RestClient:
         :param payload: Optional JSON payload
         :return: Response data
         """
-
-        my_headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        if headers:
-            my_headers.update(headers)
-
-        try:
-            response = requests.patch(url, headers=my_headers, json=payload, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            return data
-
-        except requests.exceptions.HTTPError as e:
-            if response.status_code == 401:
-                raise ValueError("Authentication failed. Check your API key")
-            elif response.status_code == 403:
-                raise ValueError("Access forbidden. Check your permissions")
-            elif response.status_code == 404:
-                raise RestException("404", 404)
-            elif response.status_code == 400:
-                raise ValueError(f"Bad request: {response.text}")
-            elif response.status_code == 429:
-                raise ValueError("Too many requests. Please try again later.")
-            elif response.status_code == 500:
-                raise ValueError("Internal server error. Please try again later.")
-            elif response.status_code == 503:
-                raise ValueError("Service unavailable. Please try again later.")
-            else:
-                raise requests.exceptions.HTTPError(f"HTTP error occurred: {e}")
-        except requests.exceptions.JSONDecodeError:
-            raise ValueError("Invalid JSON response from server")
-        except requests.exceptions.Timeout:
-            raise requests.exceptions.Timeout("Request timed out after 30 seconds")
-        except requests.exceptions.RequestException as e:
-            raise requests.exceptions.RequestException(f"Request failed: {e}")
\ No newline at end of file
+        response = RestClient.__request("PATCH", url, api_key, headers, payload=payload)
+        return JsonDecoder.loads(response.content)
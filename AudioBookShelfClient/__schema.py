@@ -0,0 +1,207 @@
+import json
+from typing import Dict, List
+
+import pandas as pd
+
+
+class BookSchema:
+    """
+    Declared schema for the books table.
+
+    Columns are named after the flattened (json_normalize) ABS library item fields so that
+    the shortcuts in Utils.REPLACEMENTS always resolve to the same column and type.  Fields
+    returned by the server that are not listed here are kept in the JSON 'extra' column.
+    """
+
+    COLUMNS: Dict[str, str] = {
+        'id': 'VARCHAR',
+        'ino': 'VARCHAR',
+        'oldLibraryItemId': 'VARCHAR',
+        'libraryId': 'VARCHAR',
+        'folderId': 'VARCHAR',
+        'path': 'VARCHAR',
+        'relPath': 'VARCHAR',
+        'isFile': 'BOOLEAN',
+        'mtimeMs': 'BIGINT',
+        'ctimeMs': 'BIGINT',
+        'birthtimeMs': 'BIGINT',
+        'addedAt': 'TIMESTAMP',
+        'updatedAt': 'TIMESTAMP',
+        'isMissing': 'BOOLEAN',
+        'isInvalid': 'BOOLEAN',
+        'mediaType': 'VARCHAR',
+        'numFiles': 'INTEGER',
+        'size': 'BIGINT',
+        'media.id': 'VARCHAR',
+        'media.metadata.title': 'VARCHAR',
+        'media.metadata.titleIgnorePrefix': 'VARCHAR',
+        'media.metadata.subtitle': 'VARCHAR',
+        'media.metadata.authorName': 'VARCHAR',
+        'media.metadata.authorNameLF': 'VARCHAR',
+        'media.metadata.narratorName': 'VARCHAR',
+        'media.metadata.seriesName': 'VARCHAR',
+        'media.metadata.genres': 'VARCHAR[]',
+        'media.metadata.publishedYear': 'INTEGER',
+        'media.metadata.publishedDate': 'VARCHAR',
+        'media.metadata.publisher': 'VARCHAR',
+        'media.metadata.description': 'VARCHAR',
+        'media.metadata.isbn': 'VARCHAR',
+        'media.metadata.asin': 'VARCHAR',
+        'media.metadata.language': 'VARCHAR',
+        'media.metadata.explicit': 'BOOLEAN',
+        'media.metadata.abridged': 'BOOLEAN',
+        'media.coverPath': 'VARCHAR',
+        'media.tags': 'VARCHAR[]',
+        'media.numTracks': 'INTEGER',
+        'media.numAudioFiles': 'INTEGER',
+        'media.numChapters': 'INTEGER',
+        'media.duration': 'DOUBLE',
+        'media.size': 'BIGINT',
+        'media.ebookFormat': 'VARCHAR',
+    }
+
+    # Low cardinality columns stored as dictionary encoded ENUMs, built from the values present at ingest
+    ENUMS: List[str] = [
+        'libraryId',
+        'mediaType',
+        'media.metadata.language',
+        'media.ebookFormat',
+    ]
+
+    EXTRA_COLUMN = 'extra'
+
+    # Per book hash of all other columns, only stored in snapshots
+    HASH_COLUMN = 'content_hash'
+
+    # Millisecond epoch values converted to TIMESTAMP
+    EPOCH_MS = ['addedAt', 'updatedAt']
+
+    @staticmethod
+    def enum_name(column: str) -> str:
+        return f"enum_{column.replace('.', '_')}"
+
+    @staticmethod
+    def column_type(column: str) -> str:
+        if column in BookSchema.ENUMS:
+            return BookSchema.enum_name(column)
+        return BookSchema.COLUMNS[column]
+
+    @staticmethod
+    def to_dataframe(books_list: List[dict]) -> pd.DataFrame:
+        """
+        Flatten the API results into a frame holding exactly the declared columns plus the
+        'extra' overflow column (a JSON object of any unknown fields, or NULL).
+        """
+        df = pd.json_normalize(books_list)
+        # Taken from the items rather than the flattened frame, which turns integers into floats
+        # when a field is missing from some items and nested fields into dotted keys
+        df[BookSchema.EXTRA_COLUMN] = [BookSchema.__dump_extra(item) for item in books_list]
+
+        for col in BookSchema.COLUMNS:
+            if col not in df.columns:
+                df[col] = None
+        return df[[*BookSchema.COLUMNS, BookSchema.EXTRA_COLUMN]]
+
+    @staticmethod
+    def __unknown(item: dict, prefix: str = '') -> dict:
+        """The fields of an item that aren't declared columns, in their original nesting."""
+        unknown = {}
+        for key, value in item.items():
+            path = prefix + key
+            if path in BookSchema.COLUMNS or value is None:
+                continue
+            if isinstance(value, dict) and any(column.startswith(path + '.') for column in BookSchema.COLUMNS):
+                value = BookSchema.__unknown(value, path + '.')
+                if not value:
+                    continue
+            unknown[key] = value
+        return unknown
+
+    @staticmethod
+    def __dump_extra(item: dict):
+        values = BookSchema.__unknown(item) if isinstance(item, dict) else None
+        return json.dumps(values, default=str) if values else None
+
+    @staticmethod
+    def __select_expr(column: str, source: str = 'src') -> str:
+        quoted = f'{source}."{column}"'
+        target = BookSchema.COLUMNS[column]
+        if column in BookSchema.EPOCH_MS:
+            return f"epoch_ms(TRY_CAST({quoted} AS BIGINT))"
+        if column in BookSchema.ENUMS:
+            return f"CAST(NULLIF(CAST({quoted} AS VARCHAR), '') AS {BookSchema.enum_name(column)})"
+        if target == 'INTEGER':
+            # publishedYear and friends may arrive as strings, or doubles when pandas saw NaN
+            return f"TRY_CAST(TRY_CAST({quoted} AS DOUBLE) AS INTEGER)"
+        return f"TRY_CAST({quoted} AS {target})"
+
+    @staticmethod
+    def create_table(conn, df: pd.DataFrame, table: str = 'books', source: str = 'books_list_df'):
+        """
+        Create the enum types and the typed table from a frame produced by to_dataframe.
+        """
+        conn.register(source, df)
+        try:
+            for column in BookSchema.ENUMS:
+                name = BookSchema.enum_name(column)
+                conn.execute(f"DROP TYPE IF EXISTS {name}")
+                conn.execute(f"""
+                    CREATE TYPE {name} AS ENUM (
+                        SELECT DISTINCT CAST("{column}" AS VARCHAR)
+                        FROM {source}
+                        WHERE "{column}" IS NOT NULL AND CAST("{column}" AS VARCHAR) <> ''
+                        ORDER BY 1
+                    )
+                """)
+
+            columns = ', '.join(f'"{col}" {BookSchema.column_type(col)}' for col in BookSchema.COLUMNS)
+            conn.execute(f'CREATE TABLE {table} ({columns}, "{BookSchema.EXTRA_COLUMN}" JSON)')
+            BookSchema.__insert(conn, table, source)
+        finally:
+            conn.unregister(source)
+
+    @staticmethod
+    def insert_rows(conn, df: pd.DataFrame, table: str = 'books', source: str = 'books_delta_df'):
+        """
+        Insert rows from a frame produced by to_dataframe into an existing table, extending the
+        enum types first if the rows contain values that haven't been seen before.
+        """
+        conn.register(source, df)
+        try:
+            for column in BookSchema.ENUMS:
+                name = BookSchema.enum_name(column)
+                new_values = [row[0] for row in conn.execute(f"""
+                    SELECT DISTINCT CAST("{column}" AS VARCHAR) AS value
+                    FROM {source}
+                    WHERE "{column}" IS NOT NULL AND CAST("{column}" AS VARCHAR) <> ''
+                      AND NOT list_contains(enum_range(NULL::{name}), CAST("{column}" AS VARCHAR))
+                """).fetchall()]
+                if new_values:
+                    existing = [row[0] for row in conn.execute(f"SELECT UNNEST(enum_range(NULL::{name}))").fetchall()]
+                    conn.execute(f'ALTER TABLE {table} ALTER "{column}" TYPE VARCHAR')
+                    conn.execute(f"DROP TYPE {name}")
+                    conn.execute(f"""
+                        CREATE TYPE {name} AS ENUM (
+                            SELECT DISTINCT CAST("{column}" AS VARCHAR) FROM {table} WHERE "{column}" IS NOT NULL
+                            UNION SELECT UNNEST({BookSchema.__literal_list(existing + new_values)})
+                            ORDER BY 1
+                        )
+                    """)
+                    conn.execute(f'ALTER TABLE {table} ALTER "{column}" TYPE {name}')
+            BookSchema.__insert(conn, table, source)
+        finally:
+            conn.unregister(source)
+
+    @staticmethod
+    def __literal_list(values: List[str]) -> str:
+        # Type DDL doesn't accept prepared parameters, so the values are inlined as escaped literals
+        return "[" + ", ".join("'" + value.replace("'", "''") + "'" for value in values) + "]::VARCHAR[]"
+
+    @staticmethod
+    def __insert(conn, table: str, source: str):
+        select = ', '.join(BookSchema.__select_expr(col) for col in BookSchema.COLUMNS)
+        conn.execute(f"""
+            INSERT INTO {table}
+            SELECT {select}, CAST(src."{BookSchema.EXTRA_COLUMN}" AS JSON)
+            FROM {source} AS src
+        """)
@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any
+
+
+class TokenBucket:
+    """
+    Classic token bucket: 'rate' tokens per second are added up to 'burst', each request takes one.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self.__refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.__refill()
+            self.rate = rate
+
+
+class ConcurrencyController:
+    """
+    Limits the number of requests in flight, adjusting the limit AIMD style: +1 per window of
+    successful requests, halved when the server signals it is overloaded.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def increase(self):
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def decrease(self):
+        with self.condition:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class Throttle:
+    """
+    Shared limiter for all outbound requests: a token bucket for the request rate and an AIMD
+    concurrency controller.  Both back off when the server answers 429/503, and ramp back up
+    while responses are healthy.  A response much slower than the recent average of its endpoint
+    only stops the ramp up, since a large page is expected to take longer than a small request.
+    """
+
+    def __init__(self, requests_per_second: float = 20, burst: int = 20, max_concurrency: int = 8,
+                 min_concurrency: int = 1, initial_concurrency: int = 4, min_rate: float = 1,
+                 latency_factor: float = 3.0):
+        self.max_rate = requests_per_second
+        self.min_rate = min(min_rate, requests_per_second)
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.concurrency = ConcurrencyController(min(initial_concurrency, max_concurrency), min_concurrency, max_concurrency)
+        self.latency_factor = latency_factor
+        self.latency: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    # 'rate_limit' settings and their defaults
+    SETTINGS = {
+        'requests_per_second': 20,
+        'burst': 20,
+        'max_concurrency': 8,
+        'min_concurrency': 1,
+        'initial_concurrency': 4,
+    }
+
+    @staticmethod
+    def settings_of(settings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """The throttle settings of a 'rate_limit' config, with defaults for missing ones."""
+        settings = settings or {}
+        return {name: settings.get(name, default) for name, default in Throttle.SETTINGS.items()}
+
+    @staticmethod
+    def from_settings(settings: Optional[Dict[str, Any]]) -> 'Throttle':
+        return Throttle(**Throttle.settings_of(settings))
+
+    @contextmanager
+    def slot(self):
+        """Wait for a token and a concurrency slot, held for the duration of one request."""
+        self.bucket.acquire()
+        self.concurrency.acquire()
+        try:
+            yield
+        finally:
+            self.concurrency.release()
+
+    @staticmethod
+    def endpoint(method: str, url: str) -> str:
+        """The method and path of a request, with ids (segments containing digits) left out."""
+        path = '/'.join('{id}' if re.search(r'\d', segment) else segment for segment in urlparse(url).path.split('/'))
+        return f"{method} {path}"
+
+    def success(self, latency: float, endpoint: str = ''):
+        with self.lock:
+            average = self.latency.get(endpoint)
+            # Slow responses under a second are never counted
+            spike = average is not None and latency > max(1.0, average * self.latency_factor)
+            self.latency[endpoint] = latency if average is None else 0.8 * average + 0.2 * latency
+        if spike:
+            return
+        self.concurrency.increase()
+        self.bucket.set_rate(min(self.max_rate, self.bucket.rate + 1))
+
+    def overloaded(self):
+        self.concurrency.decrease()
+        self.bucket.set_rate(max(self.min_rate, self.bucket.rate / 2))
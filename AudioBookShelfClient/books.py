@@ -1,7 +1,10 @@
-from typing import Optional, Dict, Any, List
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
 
 from AudioBookShelfClient import Utils
 from AudioBookShelfClient.__book_cache import BookCache, DataException
+from AudioBookShelfClient.__schema import BookSchema
 
 class NoBooksException(Exception):
     def __init__(self, message):
@@ -9,19 +12,36 @@ class NoBooksException(Exception):
 
 class Books:
 
-    def __init__(self, url, api_key, library_id: str = None):
+    def __init__(self, url, api_key, library_id: str = None, snapshot: Optional[Path] = None):
         self.__bookCache = None
         self.base_url = url
         self.api_key = api_key
         self.library_id = library_id
+        self.snapshot = snapshot
+        self.lock = threading.Lock()
 
     def __load_books(self, library_id: str):
         try:
-            if self.__bookCache is None:#
-                self.__bookCache = BookCache(library_id, self.base_url, self.api_key)
+            with self.lock:
+                if self.__bookCache is None:
+                    self.__bookCache = BookCache(library_id, self.base_url, self.api_key, self.snapshot)
         except DataException as e:
             raise NoBooksException(f"Library with ID '{library_id}': {e.message}")
 
+    def load(self):
+        self.__load_books(self.library_id)
+
+    def expand(self, concurrency: int = 8) -> Tuple[int, int]:
+        """
+        Add the chapters, audio_files and tracks tables, joinable to books on book_id, for use in
+        where clauses. Only books that are new or changed since the last expand are fetched.
+        """
+        self.__load_books(self.library_id)
+        return self.__bookCache.expand(concurrency)
+
+    def is_loaded(self) -> bool:
+        return self.__bookCache is not None
+
     def get_fields(self) -> Optional[List[str]]:
         self.__load_books(self.library_id)
         return self.__bookCache.get_columns()
@@ -30,6 +50,10 @@ class Books:
         self.__load_books(self.library_id)
         return self.__bookCache.get_all()
 
+    def get_by_ids(self, ids: List[str]) -> List[Dict[str, Any]]:
+        self.__load_books(self.library_id)
+        return self.__bookCache.get_by_ids(ids)
+
     def get_all_summary(self) -> Optional[List[Dict[str, Any]]]:
         self.__load_books(self.library_id)
         books = self.__bookCache.get_all()
@@ -41,16 +65,213 @@ class Books:
         self.__load_books(self.library_id)
         return self.__bookCache.query(query)
 
-    def where(self, where: str, order: str = None) -> Optional[List[Dict[str, Any]]]:
-        if Utils.has_keywords(where):
+    def __sort_key(self, order: str) -> Tuple[str, str]:
+        """
+        The sort expression and its type. Enums are sorted as text rather than in enum order.
+        """
+        column_type = self.__bookCache.cursor().execute(f"DESCRIBE SELECT ({order}) AS sort_key FROM books").fetchone()[1]
+        if column_type.startswith('ENUM'):
+            return f"CAST(({order}) AS VARCHAR)", 'VARCHAR'
+        return f"({order})", column_type
+
+    def where(self, where: Optional[str], order: str = None, direction: str = 'asc', limit: Optional[int] = None,
+              offset: Optional[int] = None, after: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Books matching a where clause, sorted by 'order' and then id. The page is selected in
+        DuckDB, so only the requested rows are sorted (top-N) and returned.
+
+        Args:
+            where: SQL where clause, None for all books
+            order: SQL expression to sort by
+            direction: 'asc' or 'desc'
+            limit: Maximum number of books to return
+            offset: Number of books to skip
+            after: Keyset cursor '<sort key>,<id>' of the last book of the previous page, see next_cursor.
+                   An empty sort key stands for a book without a value.
+        """
+        if where and Utils.has_keywords(where):
             raise ValueError(
                 "Disallowed SQL Keyword in WHERE clause.'"
             )
+        self.__check_page(order, direction, limit, offset, after)
 
         self.__load_books(self.library_id)
-        query = f"""
-            SELECT * FROM books WHERE {where}
+        conditions = [f"({where})"] if where else []
+        return self.__select('*', conditions, [], order, direction, limit, offset, after)
+
+    def filter(self, value: Optional[str], field: str = 'media.metadata.title', exact: bool = False,
+               ignore_case: bool = False, columns: Optional[List[str]] = None, order: str = None,
+               direction: str = 'asc', limit: Optional[int] = None, offset: Optional[int] = None,
+               after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Books whose field contains (or with exact, equals) a value, matched in DuckDB as a
+        parameterized LIKE or equality. For list fields such as genres and tags, any element can
+        match. Only the given columns (and id) are returned.
+
+        Args:
+            value: Value to match, None for all books
+            field: Column or shortcut to match against
+            exact: Match the whole value instead of a substring
+            ignore_case: Match regardless of case
+            columns: Columns to return, all when None
+            order, direction, limit, offset, after: see where
         """
+        self.__check_page(order, direction, limit, offset, after)
+        self.__load_books(self.library_id)
+        types = {row[0]: row[1] for row in self.__bookCache.cursor().execute("DESCRIBE books").fetchall()}
+
+        field = Utils.replace_shortcuts(field or 'media.metadata.title', False)
+        if field not in types:
+            raise ValueError(f"Unknown field '{field}', see 'info fields'")
+        unknown = [column for column in columns or [] if column not in types]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+        conditions = []
+        params = []
+        if value is not None:
+            column = 'x' if types[field].endswith('[]') else f'"{field}"'
+            if exact:
+                match = f"lower(CAST({column} AS VARCHAR)) = lower(?)" if ignore_case else f"CAST({column} AS VARCHAR) = ?"
+                params.append(value)
+            else:
+                match = f"CAST({column} AS VARCHAR) {'ILIKE' if ignore_case else 'LIKE'} ? ESCAPE '\\'"
+                escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params.append(f"%{escaped}%")
+            conditions.append(f'len(list_filter("{field}", x -> {match})) > 0' if column == 'x' else match)
+
+        projection = '*'
+        if columns:
+            projection = ', '.join(f'"{column}"' for column in dict.fromkeys(['id', *columns]))
+        return self.__select(projection, conditions, params, order, direction, limit, offset, after)
+
+    @staticmethod
+    def __check_page(order: Optional[str], direction: str, limit: Optional[int], offset: Optional[int], after: Optional[str]):
+        if direction not in ('asc', 'desc'):
+            raise ValueError(f"Unknown sort direction '{direction}', use asc or desc")
+        if (limit is not None and limit < 0) or (offset is not None and offset < 0):
+            raise ValueError("--limit and --offset can't be negative")
+        if after is not None and not order:
+            raise ValueError("--after needs a sort order")
+
+    def __select(self, projection: str, conditions: List[str], params: List[Any], order: Optional[str],
+                 direction: str, limit: Optional[int], offset: Optional[int], after: Optional[str]) -> List[Dict[str, Any]]:
+        order_by = ""
         if order:
-            query += f" ORDER BY {order}"
-        return self.__bookCache.query(query)
+            sort_key, sort_type = self.__sort_key(order)
+            order_by = f" ORDER BY {sort_key} {direction.upper()} NULLS LAST, id {direction.upper()}"
+            if after is not None:
+                key, _, book_id = after.rpartition(',')
+                if not book_id:
+                    raise ValueError(f"Invalid cursor '{after}', expected '<sort key>,<id>'")
+                compare = '>' if direction == 'asc' else '<'
+                if key == '':
+                    # Books without a sort key come last, ordered by id
+                    conditions.append(f"({sort_key} IS NULL AND id {compare} ?)")
+                    params += [book_id]
+                else:
+                    value = self.__bookCache.cursor().execute(f"SELECT TRY_CAST(? AS {sort_type})", [key]).fetchone()[0]
+                    if value is None:
+                        raise ValueError(f"Invalid cursor '{after}', '{key}' is not a valid {sort_type}")
+                    conditions.append(f"({sort_key} {compare} ?::{sort_type} OR ({sort_key} = ?::{sort_type} AND id {compare} ?) OR {sort_key} IS NULL)")
+                    params += [key, key, book_id]
+
+        query = f"SELECT {projection} FROM books"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += order_by
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        if offset:
+            query += f" OFFSET {int(offset)}"
+
+        cursor = self.__bookCache.cursor()
+        rows = cursor.execute(query, params).fetchall()
+        columns = [desc[0] for desc in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def next_cursor(self, order: str, book: Dict[str, Any]) -> str:
+        """
+        The '--after' cursor continuing after the given book, the last one of a page.
+        """
+        self.__load_books(self.library_id)
+        sort_key, _ = self.__sort_key(order)
+        key = self.__bookCache.cursor().execute(f"SELECT CAST({sort_key} AS VARCHAR) FROM books WHERE id = ?", [book['id']]).fetchone()[0]
+        return f"{key if key is not None else ''},{book['id']}"
+
+    def diff(self, where: str, assignments: Dict[str, str]) -> List[Dict[str, Any]]:
+        """
+        Evaluate SET style assignments against the books matching a where clause.
+
+        Args:
+            where: SQL where clause selecting the books
+            assignments: {column: SQL expression} giving each column's new value
+
+        Returns:
+            One entry per book where at least one value changes:
+            {'id', 'title', 'changes': {column: (old, new)}}, only changed columns included
+        """
+        if Utils.has_keywords(where):
+            raise ValueError(
+                "Disallowed SQL Keyword in WHERE clause.'"
+            )
+        for column in assignments:
+            if column not in BookSchema.COLUMNS:
+                raise ValueError(f"Unknown field '{column}'")
+
+        self.__load_books(self.library_id)
+        select = []
+        changed = []
+        for i, (column, expression) in enumerate(assignments.items()):
+            # Enums are compared as text so new values don't have to exist in the enum yet
+            target = 'VARCHAR' if column in BookSchema.ENUMS else BookSchema.COLUMNS[column]
+            select.append(f'CAST("{column}" AS {target}) AS old_{i}, CAST(({expression}) AS {target}) AS new_{i}')
+            changed.append(f'CAST(({expression}) AS {target}) IS DISTINCT FROM CAST("{column}" AS {target})')
+
+        rows = self.__bookCache.query(f"""
+            SELECT id, "media.metadata.title" AS title, {', '.join(select)}
+            FROM books
+            WHERE ({where}) AND ({' OR '.join(changed)})
+            ORDER BY "media.metadata.title"
+        """)
+
+        result = []
+        for row in rows:
+            changes = {}
+            for i, column in enumerate(assignments):
+                old, new = row[f"old_{i}"], row[f"new_{i}"]
+                if old != new:
+                    changes[column] = (old, new)
+            result.append({'id': row['id'], 'title': row['title'], 'changes': changes})
+        return result
+
+    def match(self, where: str, ids: List[str]) -> List[str]:
+        """
+        Return the subset of the given book ids that satisfy the where clause.
+        """
+        if Utils.has_keywords(where):
+            raise ValueError(
+                "Disallowed SQL Keyword in WHERE clause.'"
+            )
+
+        self.__load_books(self.library_id)
+        if not ids:
+            return []
+        cursor = self.__bookCache.cursor()
+        rows = cursor.execute(f"""
+            SELECT id FROM books WHERE id IN (SELECT UNNEST(?::VARCHAR[])) AND ({where})
+        """, [ids]).fetchall()
+        return [row[0] for row in rows]
+
+    def apply_delta(self, changed: List[Dict[str, Any]], removed: Optional[List[str]] = None):
+        self.__load_books(self.library_id)
+        self.__bookCache.apply_delta(changed, removed)
+
+    def watermark(self) -> Optional[int]:
+        self.__load_books(self.library_id)
+        return self.__bookCache.watermark()
+
+    def get_ids(self) -> List[str]:
+        self.__load_books(self.library_id)
+        return self.__bookCache.get_ids()
+
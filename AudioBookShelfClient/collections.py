@@ -1,13 +1,87 @@
-import json
-from types import SimpleNamespace
-from typing import Optional, Dict, Any, List
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple, TypedDict
 
+from AudioBookShelfClient.__json import JsonDecoder
 from AudioBookShelfClient.__rest_client import RestClient, RestException
+from AudioBookShelfClient.journal import Journal
 from AudioBookShelfClient.libraries import Libraries
 
 
+# Fields of the collection responses used by the models below, for typed decoding
+class _AuthorFields(TypedDict, total=False):
+    name: Optional[str]
+
+
+class _MetadataFields(TypedDict, total=False):
+    title: Optional[str]
+    authorName: Optional[str]
+    authors: Optional[List[_AuthorFields]]
+
+
+class _MediaFields(TypedDict, total=False):
+    metadata: Optional[_MetadataFields]
+
+
+class _BookFields(TypedDict, total=False):
+    id: str
+    media: Optional[_MediaFields]
+
+
+class _CollectionFields(TypedDict, total=False):
+    id: str
+    name: str
+    libraryId: Optional[str]
+    description: Optional[str]
+    books: Optional[List[_BookFields]]
+
+
+class _CollectionsResponse(TypedDict, total=False):
+    results: List[_CollectionFields]
+
+
+@dataclass(frozen=True, slots=True)
+class CollectionBook:
+    id: str
+    title: Optional[str] = None
+    authorName: Optional[str] = None
+
+    @staticmethod
+    def from_json(data: Dict[str, Any]) -> 'CollectionBook':
+        if not isinstance(data, dict) or not data.get('id'):
+            raise ValueError("Invalid book in collection response from server")
+        metadata = (data.get('media') or {}).get('metadata') or {}
+        author = metadata.get('authorName')
+        if author is None and metadata.get('authors'):
+            author = ', '.join(author.get('name', '') for author in metadata['authors'])
+        return CollectionBook(id=data['id'], title=metadata.get('title'), authorName=author)
+
+
+@dataclass(frozen=True, slots=True)
+class Collection:
+    id: str
+    name: str
+    libraryId: str
+    description: Optional[str] = None
+    book_ids: Tuple[str, ...] = ()
+
+    @staticmethod
+    def from_json(data: Dict[str, Any], library_id: Optional[str] = None) -> 'Collection':
+        if not isinstance(data, dict) or not data.get('id') or data.get('name') is None:
+            raise ValueError("Invalid collection in response from server")
+        return Collection(id=data['id'],
+                          name=data['name'],
+                          libraryId=data.get('libraryId') or library_id,
+                          description=data.get('description'),
+                          book_ids=tuple(book['id'] for book in data.get('books') or [] if isinstance(book, dict) and 'id' in book))
+
+
 class Collections:
 
+    QUERY_PREFIX = "Auto-created by abscli from query: "
+
+    # Books per create or batch add request
+    CHUNK_SIZE = 250
+
     def __init__(self, url, api_key, library_id: str = None, libs: Libraries = None):
         self.cache = None
         self.base_url = url
@@ -15,26 +89,39 @@ class Collections:
         self.library_id = library_id
         self.libraries = libs
 
+    def __load_library_collections(self, library_id: str) -> List[Collection]:
+        """
+        Load the collections of one library, keeping only the fields abscli uses and the ids of
+        the member books rather than the full book objects.
+        """
+        url = f"{self.base_url.rstrip('/')}/api/libraries/{library_id}/collections"
+        try:
+            body = RestClient.get_cached(url, self.api_key, 'collections')
+        except RestException as e:
+            if e.status_code == 404:
+                raise ValueError(f"Library with ID '{library_id}' not found") from e
+            raise
+
+        def from_json(response: Dict[str, Any]) -> List[Collection]:
+            if not isinstance(response, dict) or 'results' not in response:
+                raise ValueError("No collections found")
+            return [Collection.from_json(item, library_id) for item in response['results']]
+
+        return JsonDecoder.decode(body, from_json, _CollectionsResponse)
+
     def __load_collections(self):
         if self.cache is None:
-            url = f"{self.base_url.rstrip('/')}/api/collections"
+            if self.library_id:
+                self.cache = self.__load_library_collections(self.library_id)
+            else:
+                self.cache = [collection for library in self.libraries.get_all() or []
+                              for collection in self.__load_library_collections(library.id)]
 
-            try:
-                response_raw = RestClient.get_raw(url, self.api_key)
-                response = json.loads(response_raw.text, object_hook=lambda d: SimpleNamespace(**d))
-                if not response or not hasattr(response, 'collections'):
-                    raise ValueError("No collections found")
-
-                if self.library_id:
-                    self.cache = [item for item in response.collections if item.libraryId == self.library_id]
-                else:
-                    self.cache = response.collections
-            except RestException as e:
-                if e.status_code == 404:
-                    raise ValueError("No collections found") from e
-                raise
+    def refresh(self):
+        self.cache = None
+        self.__load_collections()
 
-    def get_all(self) -> Optional[List[SimpleNamespace]]:
+    def get_all(self) -> Optional[List[Collection]]:
         self.__load_collections()
         return self.cache
 
@@ -46,52 +133,135 @@ class Collections:
             return [{'name': item.name, 'id': item.id, 'library': library_name or self.libraries.get_by_id(item.libraryId).name} for item in collections]
         return None
 
+    @staticmethod
+    def describe(where: str) -> str:
+        return f"{Collections.QUERY_PREFIX}'{where}'"
+
+    @staticmethod
+    def query_of(collection: Collection) -> Optional[str]:
+        """
+        The where clause of a collection created by abscli, taken from its description.
+        """
+        description = collection.description or ''
+        if description.startswith(Collections.QUERY_PREFIX):
+            query = description[len(Collections.QUERY_PREFIX):].strip()
+            if len(query) >= 2 and query[0] == "'" and query[-1] == "'":
+                return query[1:-1] or None
+        return None
+
+    def get_smart(self) -> List[Collection]:
+        """Collections that were created from a where clause."""
+        return [c for c in self.get_all() if self.query_of(c)]
+
+    def get_books(self, collection: Collection) -> List[CollectionBook]:
+        """
+        Fetch the full book objects of a collection, only loaded when a command needs them.
+        """
+        url = f"{self.base_url.rstrip('/')}/api/collections/{collection.id}"
+        try:
+            return RestClient.get_auto(url, self.api_key, lambda data: [CollectionBook.from_json(book) for book in data.get('books') or []],
+                                       schema=_CollectionFields)
+        except RestException as e:
+            if e.status_code == 404:
+                raise ValueError(f"Collection '{collection.name}' not found") from e
+            raise
+
     def exists(self, name: str) -> bool:
         collections = self.get_all()
         return any(c.name == name for c in collections)
 
-    def get(self, name: str) -> Optional[SimpleNamespace]:
+    def get(self, name: str) -> Optional[Collection]:
         collections = self.get_all()
         return next((c for c in collections if c.name == name), None)
 
-    def create(self, name: str, description: str, library_id: str, items: List[Dict[str, Any]], dryrun: bool = False):
+    def create(self, name: str, description: str, library_id: str, items: List[Dict[str, Any]], dryrun: bool = False,
+               journal: Optional[Journal] = None):
+        """
+        Create a collection with its first chunk of books and add the rest in chunks. With a
+        journal from an interrupted run, the collection it created is reused and only the books
+        that weren't acknowledged are added.
+        """
         if dryrun:
             return
 
-        url = f"{self.base_url.rstrip('/')}/api/collections"
-        data = {
-            "name": name,
-            "libraryId": library_id,
-            "description": description,
-            "books": [item.get('id') for item in items]
-        }
-        try:
-            RestClient.post(url, self.api_key, payload=data)
-        except RestException as e:
-            if e.status_code == 409:
-                raise ValueError(f"Collection '{name}' already exists") from e
-            raise
+        book_ids = [item.get('id') for item in items]
+        collection_id = journal.state.get('collection_id') if journal else None
+        if collection_id is None:
+            first, book_ids = book_ids[:self.CHUNK_SIZE], book_ids[self.CHUNK_SIZE:]
+            url = f"{self.base_url.rstrip('/')}/api/collections"
+            data = {
+                "name": name,
+                "libraryId": library_id,
+                "description": description,
+                "books": first
+            }
+            if journal:
+                journal.plan([first])
+            try:
+                response = RestClient.post(url, self.api_key, payload=data)
+            except RestException as e:
+                if e.status_code == 409:
+                    raise ValueError(f"Collection '{name}' already exists") from e
+                raise
+            collection_id = (response or {}).get('id')
+            if not collection_id and book_ids:
+                # The rest of the books are added to the collection, so its id is needed
+                self.refresh()
+                collection = self.get(name)
+                if not collection:
+                    raise ValueError(f"Collection '{name}' was created without an id in the response and can't be found, "
+                                     f"only its first {len(first)} books were added")
+                collection_id = collection.id
+            if journal:
+                journal.record(collection_id=collection_id)
+                journal.done(0, first)
+
+        if book_ids:
+            self.add_books(collection_id, book_ids, journal)
+
+    def add_books(self, collection_id: str, book_ids: List[str], journal: Optional[Journal] = None):
+        """
+        Add books in chunks of CHUNK_SIZE. Chunks are sent one after the other, and with a journal
+        each acknowledged chunk is recorded and books acknowledged by an earlier run are skipped.
+        """
+        url = f"{self.base_url.rstrip('/')}/api/collections/{collection_id}/batch/add"
+        book_ids = journal.pending(list(book_ids)) if journal else list(book_ids)
+        chunks = [book_ids[i:i + self.CHUNK_SIZE] for i in range(0, len(book_ids), self.CHUNK_SIZE)]
+        if journal and chunks:
+            journal.plan(chunks)
+        for index, chunk in enumerate(chunks):
+            RestClient.post(url, self.api_key, payload={"books": chunk})
+            if journal:
+                journal.done(index, chunk)
+
+    def remove_books(self, collection_id: str, book_ids: List[str]):
+        url = f"{self.base_url.rstrip('/')}/api/collections/{collection_id}/batch/remove"
+        RestClient.post(url, self.api_key, payload={"books": list(book_ids)})
 
-    def update(self, name: str, description: str, library_id: str, items: List[Dict[str, Any]], dryrun: bool = False):
+    def update(self, name: str, description: str, library_id: str, items: List[Dict[str, Any]], dryrun: bool = False,
+               journal: Optional[Journal] = None):
         collection = self.get(name)
         if not collection:
-            self.create(name, description, library_id, items)
+            self.create(name, description, library_id, items, dryrun=dryrun, journal=journal)
             return items
 
         books = [item.get('id') for item in items]
-        existing = [c.id for c in collection.books]
-        added = set(books) - set(existing)
+        existing = set(collection.book_ids)
+        added = set(books) - existing
+
+        if (not dryrun and Collections.query_of(collection) and (description or '').startswith(self.QUERY_PREFIX)
+                and collection.description != description):
+            # The query a smart collection was last updated from is the one 'watch' keeps it in sync
+            # with. Descriptions that aren't queries are left alone
+            url = f"{self.base_url.rstrip('/')}/api/collections/{collection.id}"
+            RestClient.patch(url, self.api_key, payload={"description": description})
 
         if not added:
             return None
 
         if not dryrun:
-            url = f"{self.base_url.rstrip('/')}/api/collections/{collection.id}/batch/add"
-            data = {
-                "books": [*added]
-            }
             try:
-                RestClient.post(url, self.api_key, payload=data)
+                self.add_books(collection.id, [book for book in books if book not in existing], journal)
             except RestException as e:
                 if e.status_code == 409:
                     raise ValueError(f"Collection '{name}' already exists") from e
@@ -8,6 +8,7 @@ class Config:
     def __init__(self, config_file: str):
         self._base_url = None
         self._api_key = None
+        self._settings = {}
         self.config_file = config_file
         self.__load_config()
 
@@ -35,6 +36,7 @@ class Config:
             with open(config_file_path, 'r') as f:
                 config_data = json.load(f)
 
+            self._settings = config_data
             self._base_url = config_data.get('base_url')
             self._api_key = config_data.get('api_key')
 
@@ -52,4 +54,16 @@ class Config:
 
     @property
     def api_key(self):
-        return self._api_key
\ No newline at end of file
+        return self._api_key
+
+    @property
+    def http_cache(self):
+        return self._settings.get('http_cache', {})
+
+    @property
+    def rate_limit(self):
+        return self._settings.get('rate_limit', {})
+
+    @property
+    def json_backend(self):
+        return self._settings.get('json_backend', 'auto')
\ No newline at end of file
@@ -0,0 +1,139 @@
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Optional
+
+
+class OutputRouter(io.TextIOBase):
+    """
+    Replacement for sys.stdout/sys.stderr that sends writes from a thread to that thread's
+    capture buffer (if it has one) and everything else to the original stream.
+    """
+
+    def __init__(self, stream, local: threading.local, name: str):
+        super().__init__()
+        self.stream = stream
+        self.local = local
+        self.name = name
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self.local, self.name, None)
+        if buffer is not None:
+            return buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+
+class Daemon:
+    """
+    Serves abscli commands over a Unix socket from one long-lived process.
+
+    The protocol is one JSON object per connection in each direction:
+        request:  {"argv": [...], "cwd": "..."}
+        response: {"stdout": "...", "stderr": "...", "code": 0}
+    """
+
+    def __init__(self, socket_path: Path, handler: Callable[[List[str], str], Optional[int]],
+                 refresh: Optional[Callable[[], None]] = None, interval: int = 300):
+        """
+        Args:
+            socket_path: Path of the Unix socket to listen on
+            handler: Called with the argv and working directory of each request, returns an exit code
+            refresh: Called every 'interval' seconds from a background thread
+            interval: Seconds between refreshes
+        """
+        self.socket_path = Path(socket_path)
+        self.handler = handler
+        self.refresh = refresh
+        self.interval = interval
+        self.local = threading.local()
+        self.stopped = threading.Event()
+        self.server = None
+
+    @contextmanager
+    def capture(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        self.local.stdout, self.local.stderr = stdout, stderr
+        try:
+            yield stdout, stderr
+        finally:
+            self.local.stdout, self.local.stderr = None, None
+
+    def run_request(self, request: dict) -> dict:
+        code = 0
+        with self.capture() as (stdout, stderr):
+            try:
+                code = self.handler(request.get('argv', []), request.get('cwd') or os.getcwd()) or 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                if isinstance(e.code, str):
+                    print(e.code, file=sys.stderr)
+            except Exception as e:
+                print(f"Error: {e}", file=sys.stderr)
+                code = 1
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'code': code}
+
+    def __refresh_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Background refresh failed: {e}", file=sys.stderr)
+
+    def serve(self):
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline())
+                except ValueError:
+                    return
+                response = daemon.run_request(request)
+                self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+        original = sys.stdout, sys.stderr
+        sys.stdout = OutputRouter(original[0], self.local, 'stdout')
+        sys.stderr = OutputRouter(original[1], self.local, 'stderr')
+
+        def terminate(signum, frame):
+            raise KeyboardInterrupt()
+        signal.signal(signal.SIGTERM, terminate)
+
+        if self.refresh:
+            threading.Thread(target=self.__refresh_loop, daemon=True).start()
+
+        try:
+            with Server(str(self.socket_path), RequestHandler) as server:
+                self.server = server
+                os.chmod(self.socket_path, 0o600)
+                server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            sys.stdout, sys.stderr = original
+            self.socket_path.unlink(missing_ok=True)
+
+    def stop(self):
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
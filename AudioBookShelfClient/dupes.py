@@ -0,0 +1,149 @@
+from typing import List, Dict, Any, Optional
+
+from .books import Books
+
+
+class Duplicates:
+    """
+    Finds books that are likely to be duplicates of each other.
+
+    Exact duplicates share an ASIN, an ISBN or a normalized title and first author, and are found
+    with hash aggregation. Near duplicates are found by joining books within small blocks (same
+    first author and title prefix, or same title prefix and author initial) and scoring the
+    candidate pairs with Jaro-Winkler similarity, so books are never compared pairwise across the
+    whole library. Titles with different numbers ("Book 1", "Book 2") are different volumes, not
+    near duplicates, and a group only holds books that are all similar to each other.
+    """
+
+    KINDS = ['asin', 'isbn', 'title', 'similar']
+
+    # Blocks larger than this (e.g. a very common title prefix) are skipped for that blocking key
+    MAX_BLOCK = 200
+
+    # Normalized title and first author. titleIgnorePrefix moves leading articles to the end
+    # ("Hobbit, The"), which are then dropped.
+    NORMALIZED = r"""
+        WITH base AS (
+            SELECT
+                id,
+                "media.metadata.title" AS title,
+                "media.metadata.authorName" AS author,
+                NULLIF(upper(trim("media.metadata.asin")), '') AS asin,
+                NULLIF(regexp_replace(upper("media.metadata.isbn"), '[^0-9X]', '', 'g'), '') AS isbn,
+                lower(strip_accents(COALESCE("media.metadata.titleIgnorePrefix", "media.metadata.title", ''))) AS t,
+                lower(strip_accents(COALESCE(split_part("media.metadata.authorName", ',', 1), ''))) AS a
+            FROM books
+        ),
+        normalized AS (
+            SELECT
+                id, title, author, asin, isbn,
+                trim(regexp_replace(regexp_replace(regexp_replace(t, ',\s*(the|a|an)$', ''), '[^a-z0-9]+', ' ', 'g'), '\s+', ' ', 'g')) AS norm_title,
+                trim(regexp_replace(a, '[^a-z0-9]+', ' ', 'g')) AS norm_author,
+                list_transform(regexp_extract_all(t, '[0-9]+'), n -> COALESCE(NULLIF(ltrim(n, '0'), ''), '0')) AS numbers
+            FROM base
+        )
+    """
+
+    def __init__(self, books: Books):
+        self.books = books
+
+    def __exact(self, kind: str) -> List[Dict[str, Any]]:
+        key = {
+            'asin': 'asin',
+            'isbn': 'isbn',
+            'title': "CASE WHEN norm_title <> '' THEN norm_title || ' / ' || norm_author END",
+        }[kind]
+        return self.books.query(f"""
+            {self.NORMALIZED}
+            SELECT '{kind}' AS kind, {key} AS key, 1.0 AS score,
+                   list(id ORDER BY title) AS ids
+            FROM normalized
+            WHERE {key} IS NOT NULL
+            GROUP BY {key}
+            HAVING COUNT(*) > 1
+            ORDER BY key
+        """)
+
+    def __similar(self, threshold: float) -> List[Dict[str, Any]]:
+        pairs = self.books.query(f"""
+            {self.NORMALIZED},
+            blocked AS (
+                SELECT id, norm_title, norm_author, numbers,
+                       norm_author || '|' || left(norm_title, 3) AS block1,
+                       left(norm_title, 6) || '|' || left(norm_author, 1) AS block2
+                FROM normalized
+                WHERE norm_title <> ''
+            ),
+            sized AS (
+                SELECT *,
+                       COUNT(*) OVER (PARTITION BY block1) AS size1,
+                       COUNT(*) OVER (PARTITION BY block2) AS size2
+                FROM blocked
+            ),
+            candidates AS (
+                SELECT a.id AS id1, b.id AS id2, a.norm_title AS t1, b.norm_title AS t2, a.norm_author AS a1, b.norm_author AS a2
+                FROM sized a JOIN sized b ON a.block1 = b.block1 AND a.id < b.id AND a.numbers = b.numbers
+                WHERE a.size1 <= {self.MAX_BLOCK}
+                UNION
+                SELECT a.id, b.id, a.norm_title, b.norm_title, a.norm_author, b.norm_author
+                FROM sized a JOIN sized b ON a.block2 = b.block2 AND a.id < b.id AND a.numbers = b.numbers
+                WHERE a.size2 <= {self.MAX_BLOCK}
+            )
+            SELECT id1, id2,
+                   0.8 * jaro_winkler_similarity(t1, t2) + 0.2 * jaro_winkler_similarity(a1, a2) AS score
+            FROM candidates
+            WHERE NOT (t1 = t2 AND a1 = a2)
+              AND 0.8 * jaro_winkler_similarity(t1, t2) + 0.2 * jaro_winkler_similarity(a1, a2) >= {float(threshold)}
+        """)
+
+        # Group the pairs into cliques, most similar first. A book only joins a group when it is
+        # similar to every book in it, so A~B and B~C don't put A and C together.
+        similar: Dict[str, Dict[str, float]] = {}
+        for pair in pairs:
+            similar.setdefault(pair['id1'], {})[pair['id2']] = pair['score']
+            similar.setdefault(pair['id2'], {})[pair['id1']] = pair['score']
+
+        group_of: Dict[str, int] = {}
+        groups: List[Dict[str, Any]] = []
+        for pair in sorted(pairs, key=lambda p: (-p['score'], p['id1'], p['id2'])):
+            id1, id2 = pair['id1'], pair['id2']
+            if id1 in group_of and id2 in group_of:
+                continue
+            if id1 not in group_of and id2 not in group_of:
+                group_of[id1] = group_of[id2] = len(groups)
+                groups.append({'kind': 'similar', 'key': None, 'score': pair['score'], 'ids': [id1, id2]})
+                continue
+            member, candidate = (id1, id2) if id1 in group_of else (id2, id1)
+            group = groups[group_of[member]]
+            if all(book_id in similar[candidate] for book_id in group['ids']):
+                group_of[candidate] = group_of[member]
+                group['ids'].append(candidate)
+                group['score'] = min(group['score'], *(similar[candidate][book_id] for book_id in group['ids'][:-1]))
+
+        for group in groups:
+            group['score'] = round(group['score'], 3)
+            group['ids'].sort()
+        return groups
+
+    def find(self, kinds: Optional[List[str]] = None, threshold: float = 0.92) -> List[Dict[str, Any]]:
+        """
+        Args:
+            kinds: Which checks to run, from KINDS. Defaults to all
+            threshold: Minimum similarity (0-1) for near duplicates
+
+        Returns:
+            Groups of duplicates: {'kind', 'key', 'score', 'books': [{'id', 'title', 'author'}]}
+        """
+        groups = []
+        for kind in kinds or self.KINDS:
+            if kind not in self.KINDS:
+                raise ValueError(f"Unknown duplicate check '{kind}', use one of: {', '.join(self.KINDS)}")
+            groups += self.__similar(threshold) if kind == 'similar' else self.__exact(kind)
+
+        ids = sorted({book_id for group in groups for book_id in group['ids']})
+        books = {row['id']: {'id': row['id'], 'title': row.get('media.metadata.title'), 'author': row.get('media.metadata.authorName')}
+                 for row in self.books.get_by_ids(ids)}
+
+        for group in groups:
+            group['books'] = [books[book_id] for book_id in group.pop('ids') if book_id in books]
+        return groups
@@ -1,17 +1,91 @@
-from typing import Optional, Dict, Any, List
-
-from certifi import where
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple, TypedDict, Callable
 
+from AudioBookShelfClient.__json import JsonDecoder
 from AudioBookShelfClient.__rest_client import RestClient, RestException
+from AudioBookShelfClient.books import Books
+from AudioBookShelfClient.stats import Stats
+
+
+# Fields of the library filterdata response used by FilterData, for typed decoding
+class _FilterItemFields(TypedDict, total=False):
+    id: Optional[str]
+    name: Optional[str]
+
+
+class _FilterDataFields(TypedDict, total=False):
+    genres: List[Optional[str]]
+    tags: List[Optional[str]]
+    narrators: List[Optional[str]]
+    languages: List[Optional[str]]
+    publishers: List[Optional[str]]
+    series: List[_FilterItemFields]
+    authors: List[_FilterItemFields]
+
+
+class _FilterDataResponse(TypedDict, total=False):
+    filterdata: _FilterDataFields
+
+
+@dataclass(frozen=True, slots=True)
+class FilterItem:
+    id: str
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class FilterData:
+    genres: Tuple[str, ...] = ()
+    tags: Tuple[str, ...] = ()
+    narrators: Tuple[str, ...] = ()
+    languages: Tuple[str, ...] = ()
+    publishers: Tuple[str, ...] = ()
+    series: Tuple[FilterItem, ...] = ()
+    authors: Tuple[FilterItem, ...] = ()
+
+    @staticmethod
+    def from_json(data: Dict[str, Any]) -> 'FilterData':
+        if not isinstance(data, dict):
+            raise ValueError("Invalid filter data in response from server")
+
+        def names(key: str) -> Tuple[str, ...]:
+            return tuple(str(item) for item in data.get(key) or [] if item is not None)
+
+        def items(key: str) -> Tuple[FilterItem, ...]:
+            return tuple(FilterItem(id=item.get('id'), name=item.get('name')) for item in data.get(key) or [] if isinstance(item, dict))
+
+        return FilterData(genres=names('genres'), tags=names('tags'), narrators=names('narrators'),
+                          languages=names('languages'), publishers=names('publishers'),
+                          series=items('series'), authors=items('authors'))
 
 
 class Filters:
+    """
+    Series, genres, authors, narrators and tags of a library.
 
-    def __init__(self, url, api_key, library_id: str):
+    When the library's books are already loaded they are derived from the books table, with
+    book counts, instead of fetching the library's filter data from the server.
+    """
+
+    # Listing -> Stats dimension used to derive it from the books table
+    LOCAL = {
+        'series': 'series',
+        'genres': 'genre',
+        'authors': 'author',
+        'narrators': 'narrator',
+        'tags': 'tag',
+    }
+
+    def __init__(self, url, api_key, library_id: str, books: Optional[Callable[[], Optional[Books]]] = None):
+        """
+        Args:
+            books: Returns the library's Books when they are loaded, otherwise None
+        """
         self.cache = None
         self.base_url = url
         self.api_key = api_key
         self.library_id = library_id
+        self.books = books
 
     def __load_filters(self):
         if self.cache is None:
@@ -21,29 +95,63 @@ class Filters:
             }
 
             try:
-                response = RestClient.get(url, self.api_key, params=params)
-                self.cache = response['filterdata']
+                body = RestClient.get_cached(url, self.api_key, 'filterdata', params=params)
+                self.cache = JsonDecoder.decode(body, lambda response: FilterData.from_json(response.get('filterdata')), _FilterDataResponse)
             except RestException as e:
                 if e.status_code == 404:
                     raise ValueError(f"Library with ID '{self.library_id}' not found")
                 else:
                     raise e
-    def get(self, name: str) -> Optional[List[Dict[str, Any]]]:
+
+    def get(self, name: str) -> Optional[Tuple[Any, ...]]:
         self.__load_filters()
-        return self.cache.get(name)
+        return getattr(self.cache, name, None)
+
+    def __loaded_books(self) -> Optional[Books]:
+        books = self.books() if self.books else None
+        # A snapshot's books are the only source of the listings when running from one
+        return books if books is not None and (books.is_loaded() or books.snapshot is not None) else None
+
+    def get_list(self, name: str, with_id: bool = False, books: Optional[Books] = None) -> List[Dict[str, Any]]:
+        """
+        One of the LOCAL listings, sorted by name.
+
+        Args:
+            name: Key of LOCAL
+            with_id: Include the id of series and authors, which are only known from the filter data
+            books: Derive the listing from these books, even if they aren't loaded yet
+
+        Returns:
+            [{'name', 'books'}] when derived from the books, [{'name', 'id'}] or [{'name'}] from the filter data.
+            Derived series and authors also have 'id' when with_id is set.
+        """
+        if name not in self.LOCAL:
+            raise ValueError(f"Unknown listing '{name}', use one of: {', '.join(self.LOCAL)}")
+
+        books = books or self.__loaded_books()
+        if books is None:
+            self.__load_filters()
+            items = getattr(self.cache, name)
+            if name in ('series', 'authors'):
+                return sorted(({'name': item.name, 'id': item.id} for item in items), key=lambda item: item['name'] or '')
+            return [{'name': item} for item in sorted(items)]
+
+        data = [{'name': row['name'], 'books': row['books']} for row in Stats(books).get(self.LOCAL[name], sort='name')]
+        if with_id and name in ('series', 'authors'):
+            try:
+                self.__load_filters()
+                ids = {item.name: item.id for item in getattr(self.cache, name)}
+            except ValueError:
+                # Offline without cached filter data, a snapshot doesn't have the ids
+                if books.snapshot is None:
+                    raise
+                ids = {}
+            for item in data:
+                item['id'] = ids.get(item['name'], '')
+        return data
 
     def get_genres(self) -> Optional[List[Dict[str, Any]]]:
-        self.__load_filters()
-        #return self.cache.get('genres')
-        return [{'name': item} for item in self.cache.get('genres')]
+        return self.get_list('genres')
 
     def get_series(self) -> Optional[List[Dict[str, Any]]]:
-        self.__load_filters()
-        return self.cache.get('series')
-
-    def search(self, query: str, exact: bool) -> Optional[List[Dict[str, Any]]]:
-        self.__load_filters()
-        if exact:
-            return [item for item in self.cache if query == item.get('name')]
-        else:
-            return [item for item in self.cache if query in item.get('name')]
\ No newline at end of file
+        return self.get_list('series', with_id=True)
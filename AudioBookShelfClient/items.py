@@ -0,0 +1,103 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+from AudioBookShelfClient.__rest_client import RestClient
+from AudioBookShelfClient.journal import Journal
+
+
+class Items:
+    """
+    Batched metadata updates through /api/items/batch/update.
+    """
+
+    # Book table column -> (key in the media payload, key in its metadata or None, converter)
+    FIELDS: Dict[str, Tuple[str, Optional[str], Callable[[Any], Any]]] = {
+        'media.metadata.title': ('metadata', 'title', lambda v: v),
+        'media.metadata.subtitle': ('metadata', 'subtitle', lambda v: v),
+        'media.metadata.authorName': ('metadata', 'authors', lambda v: [{'name': name} for name in Items.split_names(v)]),
+        'media.metadata.narratorName': ('metadata', 'narrators', lambda v: Items.split_names(v)),
+        'media.metadata.genres': ('metadata', 'genres', lambda v: list(v or [])),
+        'media.metadata.publishedYear': ('metadata', 'publishedYear', lambda v: None if v is None else str(v)),
+        'media.metadata.publishedDate': ('metadata', 'publishedDate', lambda v: v),
+        'media.metadata.publisher': ('metadata', 'publisher', lambda v: v),
+        'media.metadata.description': ('metadata', 'description', lambda v: v),
+        'media.metadata.isbn': ('metadata', 'isbn', lambda v: v),
+        'media.metadata.asin': ('metadata', 'asin', lambda v: v),
+        'media.metadata.language': ('metadata', 'language', lambda v: v),
+        'media.metadata.explicit': ('metadata', 'explicit', bool),
+        'media.metadata.abridged': ('metadata', 'abridged', bool),
+        'media.tags': ('tags', None, lambda v: list(v or [])),
+    }
+
+    def __init__(self, url, api_key):
+        self.base_url = url
+        self.api_key = api_key
+
+    @staticmethod
+    def split_names(value: Optional[str]) -> List[str]:
+        return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+    @staticmethod
+    def check_field(column: str):
+        if column not in Items.FIELDS:
+            raise ValueError(f"Field '{column}' can't be updated, supported fields are: {', '.join(Items.FIELDS)}")
+
+    @staticmethod
+    def payload(changes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the mediaPayload for one item from a {column: new value} dict.
+        """
+        media = {}
+        for column, value in changes.items():
+            Items.check_field(column)
+            key, metadata_key, convert = Items.FIELDS[column]
+            if metadata_key:
+                media.setdefault(key, {})[metadata_key] = convert(value)
+            else:
+                media[key] = convert(value)
+        return media
+
+    @staticmethod
+    def __key(update: Dict[str, Any]) -> str:
+        # An update is only acknowledged for the values it sent
+        payload = json.dumps(update.get('mediaPayload'), sort_keys=True, default=str)
+        return f"{update['id']}:{hashlib.md5(payload.encode('utf-8')).hexdigest()}"
+
+    def batch_update(self, updates: List[Dict[str, Any]], chunk_size: int = 50, concurrency: int = 4,
+                     on_chunk: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None,
+                     journal: Optional[Journal] = None) -> int:
+        """
+        Send updates in chunks, several chunks at a time. The shared RestClient throttle still
+        applies, so concurrency is an upper bound.
+
+        Args:
+            updates: List of {'id': ..., 'mediaPayload': {...}}
+            chunk_size: Number of items per request
+            concurrency: Maximum number of requests in flight
+            on_chunk: Called with the chunk number and its updates after each chunk succeeds
+            journal: Records the acknowledged chunks. Updates acknowledged by an earlier run, with
+                     the same payload, are skipped
+
+        Returns:
+            Number of items updated
+        """
+        url = f"{self.base_url.rstrip('/')}/api/items/batch/update"
+        if journal:
+            keyed = {Items.__key(update): update for update in updates}
+            updates = [keyed[key] for key in journal.pending(list(keyed))]
+        chunks = [updates[i:i + chunk_size] for i in range(0, len(updates), chunk_size)]
+        if journal and chunks:
+            journal.plan([[Items.__key(update) for update in chunk] for chunk in chunks])
+
+        def send(index: int) -> int:
+            RestClient.post(url, self.api_key, payload=chunks[index])
+            if journal:
+                journal.done(index, [Items.__key(update) for update in chunks[index]])
+            if on_chunk:
+                on_chunk(index, chunks[index])
+            return len(chunks[index])
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            return sum(executor.map(send, range(len(chunks))))
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set
+
+from .utils import Utils
+
+
+class Journal:
+    """
+    Append-only checkpoint file of a bulk operation, one JSON line per event: the chunks it
+    planned to send and the chunks the server acknowledged.
+
+    An operation is identified by its name and scope (e.g. server, library and collection), so a
+    rerun with resume reads the journal of the interrupted run and skips the items of every
+    acknowledged chunk. Items are keyed rather than chunks, so the outstanding items can be
+    chunked differently when the plan changed in between. The journal is removed once the
+    operation completes.
+    """
+
+    def __init__(self, operation: str, *scope: str, resume: bool = False, path: Optional[Path] = None):
+        self.operation = operation
+        self.scope = list(scope)
+        key = hashlib.sha256(json.dumps([operation, *scope]).encode('utf-8')).hexdigest()[:16]
+        self.path = path or Utils.cache_dir('journal') / f"{operation.replace(' ', '-')}-{key}.jsonl"
+        self.acknowledged: Set[str] = set()
+        self.state: Dict[str, Any] = {}
+        self.skipped = 0
+        self.__lock = threading.Lock()
+        # Without resume, an earlier journal is only replaced once this run sends something, so a
+        # run that fails before that doesn't lose it
+        self.__replace = not resume
+
+        if resume:
+            self.__read()
+        self.resumed = bool(self.acknowledged or self.state)
+
+    def __read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of a run that died while writing it
+                continue
+            if entry.get('event') == 'done':
+                self.acknowledged.update(entry.get('keys') or [])
+            elif entry.get('event') == 'state':
+                self.state.update(entry.get('values') or {})
+
+    def __append(self, entry: Dict[str, Any]):
+        entry['at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        line = json.dumps(entry, default=str) + '\n'
+        with self.__lock:
+            with open(self.path, 'w' if self.__replace else 'a', encoding='utf-8') as f:
+                self.__replace = False
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending(self, keys: List[str]) -> List[str]:
+        """The keys not acknowledged by an earlier run, in the given order."""
+        pending = [key for key in keys if key not in self.acknowledged]
+        self.skipped += len(keys) - len(pending)
+        return pending
+
+    def plan(self, chunks: List[List[str]]):
+        self.__append({'event': 'plan', 'operation': self.operation, 'scope': self.scope, 'chunks': chunks})
+
+    def done(self, index: int, keys: List[str]):
+        self.acknowledged.update(keys)
+        self.__append({'event': 'done', 'chunk': index, 'keys': keys})
+
+    def record(self, **values: Any):
+        """Record state a resumed run needs, such as the id of a collection the operation created."""
+        self.state.update(values)
+        self.__append({'event': 'state', 'values': values})
+
+    def finish(self):
+        self.path.unlink(missing_ok=True)
@@ -1,46 +1,64 @@
-import json
-from types import SimpleNamespace
-from typing import Optional, Dict, Any, List
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, TypedDict
 
+from AudioBookShelfClient.__json import JsonDecoder
 from AudioBookShelfClient.__rest_client import RestClient, RestException
 
+
+# Fields of the /api/libraries response used by Library, for typed decoding
+class _LibraryFields(TypedDict, total=False):
+    id: str
+    name: str
+    mediaType: str
+
+
+class _LibrariesResponse(TypedDict, total=False):
+    libraries: List[_LibraryFields]
+
+
+@dataclass(frozen=True, slots=True)
 class Library:
-    def __init__(self, name: str, id: Optional[str] = None):
-        self._name = name
-        self._id = id
+    name: str
+    id: Optional[str] = None
+    mediaType: str = 'book'
 
-    @property
-    def id(self) -> str | None:
-        return self._id
+    @staticmethod
+    def from_json(data: Dict[str, Any]) -> 'Library':
+        if not isinstance(data, dict) or not data.get('id') or not data.get('name'):
+            raise ValueError("Invalid library in response from server")
+        return Library(name=data['name'], id=data['id'], mediaType=data.get('mediaType', 'book'))
 
-    @property
-    def name(self) -> str:
-        return self._name
 
 class Libraries:
 
-    def __init__(self, url, api_key):
-        self.cache = None
-        self.cache_objects = None
+    def __init__(self, url, api_key, libraries: Optional[List[Library]] = None):
+        """
+        Args:
+            libraries: Use these libraries instead of loading them from the server
+        """
+        self.cache = libraries
         self.base_url = url
         self.api_key = api_key
 
-    def __load_libraries(self):
+    def __load_libraries(self, max_age: Optional[int] = None):
         if self.cache is None:
             url = f"{self.base_url.rstrip('/')}/api/libraries"
 
             try:
-                response_raw = RestClient.get_raw(url, self.api_key)
-                response = json.loads(response_raw.text, object_hook=lambda d: SimpleNamespace(**d))
-                if not response or not hasattr(response, 'libraries'):
-                    raise ValueError("No libraries found")
-                self.cache = response.libraries
+                body = RestClient.get_cached(url, self.api_key, 'libraries', max_age=max_age)
+                self.cache = JsonDecoder.decode(body, self.__from_json, _LibrariesResponse)
             except RestException as e:
                 if e.status_code == 404:
                     raise ValueError("No libraries found") from e
                 raise
 
-    def get_all(self) -> Optional[List[Any]]:
+    @staticmethod
+    def __from_json(response: Dict[str, Any]) -> List[Library]:
+        if not isinstance(response, dict) or 'libraries' not in response:
+            raise ValueError("No libraries found")
+        return [Library.from_json(item) for item in response['libraries']]
+
+    def get_all(self) -> Optional[List[Library]]:
         self.__load_libraries()
         return [library for library in self.cache if library.mediaType == 'book']
 
@@ -63,11 +81,11 @@ class Libraries:
         if not id:
             return None
 
-        libraries = self.get_all();
+        libraries = self.get_all()
         if libraries:
             return next((lib for lib in libraries if lib.id == id), None)
         return None
 
     def refresh(self):
         self.cache = None
-        self.__load_libraries()
+        self.__load_libraries(max_age=0)
@@ -0,0 +1,140 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, List, Callable
+
+from .books import Books, NoBooksException
+from .collections import Collections
+from .filters import Filters
+from .libraries import Libraries
+from .snapshots import Snapshots
+
+
+class Session:
+    """
+    Holds the Libraries, Collections, Filters and per-library Books objects for one server so
+    they can be reused by several commands (e.g. by the daemon) instead of being rebuilt each time.
+
+    With a snapshot, the snapshot's library is the only library and its books come from the file.
+    """
+
+    def __init__(self, url: str, api_key: str, snapshot: Optional[Path] = None):
+        self.base_url = url
+        self.api_key = api_key
+        self.snapshot = snapshot
+        self.libraries: Optional[Libraries] = None
+        self.collections: Dict[Optional[str], Collections] = {}
+        self.books: Dict[str, Books] = {}
+        self.filters: Dict[str, Filters] = {}
+        self.lock = threading.RLock()
+
+    def get_libraries(self) -> Libraries:
+        with self.lock:
+            if self.libraries is None:
+                snapshot_libraries = [Snapshots.library(self.snapshot)] if self.snapshot else None
+                self.libraries = Libraries(self.base_url, self.api_key, snapshot_libraries)
+            return self.libraries
+
+    def get_collections(self, library_id: Optional[str]) -> Collections:
+        with self.lock:
+            if library_id not in self.collections:
+                self.collections[library_id] = Collections(self.base_url, self.api_key, library_id, self.get_libraries())
+            return self.collections[library_id]
+
+    def get_books(self, library_id: str) -> Books:
+        with self.lock:
+            if library_id not in self.books:
+                self.books[library_id] = Books(self.base_url, self.api_key, library_id, self.snapshot)
+            return self.books[library_id]
+
+    def __filter_books(self, library_id: str) -> Callable[[], Optional[Books]]:
+        # The books listings are derived from: a snapshot's, or the server's once they are loaded
+        if self.snapshot:
+            return lambda: self.get_books(library_id)
+        return lambda: self.books.get(library_id)
+
+    def get_filters(self, library_id: str) -> Filters:
+        with self.lock:
+            if library_id not in self.filters:
+                self.filters[library_id] = Filters(self.base_url, self.api_key, library_id, self.__filter_books(library_id))
+            return self.filters[library_id]
+
+    def prefetch(self, library_id: str, collections: bool = False, books: bool = False, filters: bool = False):
+        """
+        Load the given resources of a library at the same time rather than one after the other.
+        They only depend on the library id, so a command that needs several of them waits for
+        the slowest request instead of the sum of all of them. Already loaded resources are kept.
+        """
+        tasks: List[Callable[[], None]] = []
+        if collections:
+            tasks.append(lambda: self.get_collections(library_id).get_all())
+        if books:
+            tasks.append(lambda: self.__prefetch_books(library_id))
+        if filters:
+            tasks.append(lambda: self.get_filters(library_id).get('genres'))
+        if len(tasks) < 2:
+            for task in tasks:
+                task()
+            return
+
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, task) for task in tasks]
+            for future in futures:
+                future.result()
+
+    def __prefetch_books(self, library_id: str):
+        try:
+            self.get_books(library_id).load()
+        except NoBooksException:
+            # Reported by the command when it uses the books
+            pass
+
+    def invalidate_collections(self, library_id: Optional[str] = None):
+        """Drop cached collections for the library and the server wide list after a change."""
+        with self.lock:
+            self.collections.pop(library_id, None)
+            self.collections.pop(None, None)
+
+    def invalidate_books(self, library_id: str):
+        """Drop the cached books of a library after they have been changed on the server."""
+        with self.lock:
+            self.books.pop(library_id, None)
+            self.filters.pop(library_id, None)
+
+    def refresh(self):
+        """
+        Reload everything that has been loaded so far. New objects are fully loaded before they
+        replace the old ones, so commands running at the same time keep a consistent view.
+        """
+        libraries = Libraries(self.base_url, self.api_key)
+        libraries.get_all()
+
+        with self.lock:
+            collection_ids = list(self.collections)
+            book_ids = list(self.books)
+            filter_ids = list(self.filters)
+
+        collections = {}
+        for library_id in collection_ids:
+            collections[library_id] = Collections(self.base_url, self.api_key, library_id, libraries)
+            collections[library_id].get_all()
+
+        books = {}
+        for library_id in book_ids:
+            books[library_id] = Books(self.base_url, self.api_key, library_id)
+            try:
+                books[library_id].load()
+            except NoBooksException:
+                pass
+
+        filters = {}
+        for library_id in filter_ids:
+            filters[library_id] = Filters(self.base_url, self.api_key, library_id, self.__filter_books(library_id))
+            filters[library_id].get('genres')
+
+        with self.lock:
+            self.libraries = libraries
+            self.collections.update(collections)
+            self.books.update(books)
+            self.filters.update(filters)
@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import duckdb
+
+from .books import Books
+from .libraries import Library
+from .__schema import BookSchema
+
+
+class Snapshots:
+    """
+    A library's books table saved as a ZSTD compressed Parquet file, with a content hash per book
+    and the library in the file's key/value metadata.
+
+    Snapshots can be queried instead of the server (see Books) and compared with each other. The
+    comparison anti-joins the two files on id and joins them on id where the hashes differ, so
+    only the modified books are compared field by field.
+    """
+
+    @staticmethod
+    def __literal(path: Path) -> str:
+        return "'" + str(path).replace("'", "''") + "'"
+
+    @staticmethod
+    def save(books: Books, library: Library, path: Path) -> int:
+        """
+        Returns:
+            Number of books saved
+        """
+        metadata = {
+            'library_id': library.id,
+            'library_name': library.name,
+            'saved_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        kv = ', '.join(f"{key}: {Snapshots.__literal(value)}" for key, value in metadata.items())
+        result = books.query(f"""
+            COPY (SELECT *, md5(CAST(books AS VARCHAR)) AS {BookSchema.HASH_COLUMN} FROM books ORDER BY id)
+            TO {Snapshots.__literal(path)} (FORMAT PARQUET, COMPRESSION ZSTD, KV_METADATA {{{kv}}})
+        """)
+        return next(iter(result[0].values())) if result else 0
+
+    @staticmethod
+    def info(path: Path) -> Dict[str, str]:
+        """The key/value metadata of a snapshot: library_id, library_name and saved_at."""
+        path = Path(path)
+        if not path.is_file():
+            raise ValueError(f"Snapshot '{path}' not found")
+        try:
+            rows = duckdb.connect(':memory:').execute(
+                f"SELECT key, value FROM parquet_kv_metadata({Snapshots.__literal(path)})"
+            ).fetchall()
+        except duckdb.Error as e:
+            raise ValueError(f"'{path}' is not a snapshot: {e}")
+        info = {key.decode('utf-8'): value.decode('utf-8') for key, value in rows}
+        if 'library_id' not in info:
+            raise ValueError(f"'{path}' is not a snapshot")
+        return info
+
+    @staticmethod
+    def library(path: Path) -> Library:
+        info = Snapshots.info(path)
+        return Library(name=info.get('library_name') or info['library_id'], id=info['library_id'])
+
+    @staticmethod
+    def diff(old: Path, new: Path) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Returns:
+            {'added': [...], 'removed': [...], 'modified': [...]}, each a list of
+            {'id', 'title', 'author'}; modified books also have 'fields', the changed columns
+        """
+        for path in (old, new):
+            Snapshots.info(path)
+
+        conn = duckdb.connect(':memory:')
+        conn.execute(f"CREATE VIEW old AS SELECT * FROM read_parquet({Snapshots.__literal(old)})")
+        conn.execute(f"CREATE VIEW new AS SELECT * FROM read_parquet({Snapshots.__literal(new)})")
+
+        def columns(view: str) -> List[str]:
+            return [row[0] for row in conn.execute(f"DESCRIBE {view}").fetchall()]
+
+        new_columns = columns('new')
+        common = [column for column in columns('old') if column in new_columns and column not in ('id', BookSchema.HASH_COLUMN)]
+
+        def rows(sql: str) -> List[Dict[str, Any]]:
+            cursor = conn.execute(sql)
+            names = [desc[0] for desc in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+        summary = 'id, "media.metadata.title" AS title, "media.metadata.authorName" AS author'
+        added = rows(f"SELECT {summary} FROM new ANTI JOIN old USING (id) ORDER BY title, id")
+        removed = rows(f"SELECT {summary} FROM old ANTI JOIN new USING (id) ORDER BY title, id")
+
+        # Values are compared as text, so columns whose type changed between snapshots still match
+        changed = ', '.join(
+            f"""CASE WHEN CAST(o."{column}" AS VARCHAR) IS DISTINCT FROM CAST(n."{column}" AS VARCHAR) THEN '{column}' END"""
+            for column in common
+        )
+        modified = rows(f"""
+            SELECT * FROM (
+                SELECT n.id, n."media.metadata.title" AS title, n."media.metadata.authorName" AS author,
+                       list_filter([{changed}], x -> x IS NOT NULL) AS fields
+                FROM new n JOIN old o ON n.id = o.id
+                WHERE n.{BookSchema.HASH_COLUMN} IS DISTINCT FROM o.{BookSchema.HASH_COLUMN}
+            )
+            WHERE len(fields) > 0
+            ORDER BY title, id
+        """) if common else []
+
+        return {'added': added, 'removed': removed, 'modified': modified}
+
+    @staticmethod
+    def resolve(path: Optional[str], cwd: Optional[str] = None) -> Optional[Path]:
+        """A path given on the command line, relative to cwd (e.g. the daemon client's) if set."""
+        if not path:
+            return None
+        path = Path(path).expanduser()
+        return path if path.is_absolute() or not cwd else Path(cwd) / path
@@ -0,0 +1,81 @@
+from typing import Optional, List, Dict, Any
+
+from .books import Books
+from .utils import Utils
+
+
+class Stats:
+    """
+    Grouped library statistics, aggregated in DuckDB over the books table.
+    """
+
+    # Dimension name -> SQL producing one or more group values per book (lists are unnested)
+    DIMENSIONS = {
+        'author': """UNNEST(string_split("media.metadata.authorName", ', '))""",
+        'narrator': """UNNEST(string_split("media.metadata.narratorName", ', '))""",
+        'series': """UNNEST(list_transform(string_split("media.metadata.seriesName", ', '), s -> regexp_replace(s, ' #[0-9.]+$', '')))""",
+        'genre': """UNNEST("media.metadata.genres")""",
+        'tag': """UNNEST("media.tags")""",
+        'publisher': '"media.metadata.publisher"',
+        'language': '"media.metadata.language"',
+        'format': '"media.ebookFormat"',
+        'year': '"media.metadata.publishedYear"',
+        'decade': '("media.metadata.publishedYear" // 10) * 10',
+    }
+
+    METRICS = {
+        'books': 'COUNT(DISTINCT id)',
+        'hours': 'ROUND(SUM("media.duration") / 3600, 1)',
+        'average': 'ROUND(AVG("media.duration") / 3600, 2)',
+        'size': 'ROUND(SUM("media.size") / 1e9, 2)',
+        'files': 'SUM("media.numAudioFiles")',
+    }
+
+    def __init__(self, books: Books):
+        self.books = books
+
+    @staticmethod
+    def dimension(group_by: str) -> str:
+        if group_by in Stats.DIMENSIONS:
+            return Stats.DIMENSIONS[group_by]
+        # Any other field or shortcut is grouped on as is
+        return Utils.replace_shortcuts(group_by) if group_by.startswith('_') else f'"{group_by}"'
+
+    def get(self, group_by: Optional[str] = None, where: Optional[str] = None, sort: str = 'books',
+            top: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Args:
+            group_by: A name from DIMENSIONS, a field name or a shortcut. None for library totals
+            where: Optional SQL where clause restricting the books
+            sort: Metric to order the groups by (descending), or 'name'
+            top: Only return the first N groups
+
+        Returns:
+            One dict per group with 'name' and every metric in METRICS
+        """
+        if where and Utils.has_keywords(where):
+            raise ValueError(
+                "Disallowed SQL Keyword in WHERE clause.'"
+            )
+        if sort != 'name' and sort not in Stats.METRICS:
+            raise ValueError(f"Unknown metric '{sort}', use one of: name, {', '.join(Stats.METRICS)}")
+
+        metrics = ', '.join(f"{sql} AS {name}" for name, sql in Stats.METRICS.items())
+        filtered = f"SELECT * FROM books WHERE {where}" if where else "SELECT * FROM books"
+
+        if not group_by:
+            return self.books.query(f"SELECT 'All books' AS name, {metrics} FROM ({filtered})")
+
+        order = "name ASC" if sort == 'name' else f"{sort} DESC, name ASC"
+        limit = f"LIMIT {int(top)}" if top else ""
+        return self.books.query(f"""
+            WITH grouped AS (
+                SELECT {self.dimension(group_by)} AS name, * FROM ({filtered})
+            )
+            SELECT CAST(name AS VARCHAR) AS name, {metrics}
+            FROM grouped
+            WHERE name IS NOT NULL AND CAST(name AS VARCHAR) <> ''
+            GROUP BY name
+            ORDER BY {order}
+            {limit}
+        """)
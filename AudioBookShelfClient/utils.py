@@ -1,3 +1,5 @@
+import re
+from pathlib import Path
 from typing import Dict, Any, List, Optional
 
 class Utils:
@@ -33,13 +35,22 @@ class Utils:
 
     KEYWORDS = ['SELECT', 'FROM', 'WHERE', 'ORDER', 'BY', 'ASC', 'DESC', 'LIMIT', 'OFFSET']
 
+    # A single quoted SQL string literal, with '' as an escaped quote
+    LITERAL = r"'(?:[^']|'')*'"
+
     @staticmethod
-    def apply_filter(data: List[Dict[str, Any]], filter: str, exact: bool = False, field: str = 'name') -> List[Dict[str, Any]]:
+    def apply_filter(data: List[Dict[str, Any]], filter: str, exact: bool = False, field: str = 'name',
+                     ignore_case: bool = False) -> List[Dict[str, Any]]:
         field = Utils.replace_shortcuts(field, False)
+        if ignore_case:
+            filter = filter.casefold()
+            value = lambda item: (item.get(field) or '').casefold()
+        else:
+            value = lambda item: item.get(field) or ''
         if exact:
-            return [item for item in data if filter == item.get(field, '')]
+            return [item for item in data if filter == value(item)]
         else:
-            return [item for item in data if filter in item.get(field, '')]
+            return [item for item in data if filter in value(item)]
 
     @staticmethod
     def print_summary(data: List[Dict[str, Any]], with_guid: bool = False, field: str = 'name', seperator: str = None):
@@ -87,28 +98,42 @@ class Utils:
         if not text:
             return None
 
-        words = text.split()
-        result = []
         unknown = []
-        for word in words:
-            if word.startswith('_'):
-                if word in Utils.REPLACEMENTS:
-                    result.append(("\"" if quote else "") + Utils.REPLACEMENTS[word] + ("\"" if quote else ""))
-                else:
-                    unknown.append(word)
-            else:
-                result.append(word)
+
+        def replace(match: re.Match) -> str:
+            word = match.group(0)
+            if not word.startswith('_'):
+                return word
+            if word in Utils.REPLACEMENTS:
+                return ("\"" if quote else "") + Utils.REPLACEMENTS[word] + ("\"" if quote else "")
+            unknown.append(word)
+            return word
+
+        # String literals are kept as they are, e.g. the two spaces in '%  %'
+        parts = re.split(f"({Utils.LITERAL})", text.strip())
+        result = ''.join(part if i % 2 else re.sub(r'\S+', replace, part) for i, part in enumerate(parts))
         if unknown:
             raise ValueError(f"Warning: Unknown shortcuts: {', '.join(unknown)}")
-        return ' '.join(result)
+        return result
 
     @staticmethod
     def has_keywords(text: str) -> bool:
-        if not text:
-            intersection_set = set(Utils.KEYWORDS).intersection(set(text.upper().split()))
+        if text:
+            # Words inside string literals, e.g. 'Order of the Phoenix', are values rather than SQL
+            words = re.sub(Utils.LITERAL, ' ', text).upper().split()
+            intersection_set = set(Utils.KEYWORDS).intersection(set(words))
             return len(intersection_set) > 0
         return False
 
+    @staticmethod
+    def cache_dir(*parts: str) -> Path:
+        """
+        Return (and create) a directory under the user's abscli cache directory.
+        """
+        path = Path.home().joinpath('.cache', 'abscli', *parts)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
     @staticmethod
     def find_shortcut(text: str) -> Optional[str]:
         for key, value in Utils.REPLACEMENTS.items():
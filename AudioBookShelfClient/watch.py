@@ -0,0 +1,198 @@
+import sys
+import time
+from typing import Optional, List, Dict, Any, Set, Tuple
+
+import requests
+
+from AudioBookShelfClient.__rest_client import RestClient, RestException
+from AudioBookShelfClient.books import Books, NoBooksException
+from AudioBookShelfClient.collections import Collections
+
+
+class Watcher:
+    """
+    Keeps the smart collections of a library (those created from a where clause) in sync with the
+    books on the server.
+
+    Each poll fetches the items updated since the last one (newest first, usually a single page),
+    applies them to the local book table and re-evaluates the collection queries against those items alone. Add and remove
+    requests are only sent for collections whose membership actually changed. Only books the
+    query matched on an earlier poll are removed, so books added by hand or by another query stay.
+    """
+
+    PAGE_SIZE = 100
+    COLLECTIONS_REFRESH = 3600
+
+    def __init__(self, url: str, api_key: str, library_id: str, books: Books, collections: Collections,
+                 interval: int = 60, max_backoff: int = 900, dryrun: bool = False, remove: bool = True):
+        self.base_url = url
+        self.api_key = api_key
+        self.library_id = library_id
+        self.books = books
+        self.collections = collections
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.dryrun = dryrun
+        self.remove = remove
+        self.watermark: Optional[int] = None
+        self.members: Dict[str, Set[str]] = {}
+        # Books each collection's query matched on a poll, the only ones it may remove
+        self.matched: Dict[str, Set[str]] = {}
+        self.invalid: Set[str] = set()
+        self.collections_loaded = 0.0
+        self.pending: List[str] = []
+
+    def __load(self):
+        self.books.load()
+        self.watermark = self.books.watermark() or 0
+
+    def __get_items(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.base_url.rstrip('/')}/api/libraries/{self.library_id}/items"
+        try:
+            return RestClient.get(url, self.api_key, params={**params, 'minified': 1}) or {}
+        except RestException as e:
+            if e.status_code == 404:
+                raise ValueError(f"Library with ID '{self.library_id}' not found") from e
+            raise
+
+    def __fetch_all(self) -> List[Dict[str, Any]]:
+        """Every item in a single response, so items moving between pages can't be missed."""
+        return self.__get_items({}).get('results') or []
+
+    def __fetch_changed(self) -> Tuple[List[Dict[str, Any]], Optional[List[Dict[str, Any]]], int]:
+        """
+        Fetch the items updated after the watermark, newest first, stopping at the first item
+        that is already known. Usually that is a single page.
+
+        Servers that don't sort by updatedAt return a page in another order, then every item is
+        fetched in one response and compared here instead.
+
+        Returns:
+            The changed items, every item when they had to be fetched (else None), and the
+            server's total item count
+        """
+        changed: Dict[str, Dict[str, Any]] = {}
+        page = 0
+        while True:
+            response = self.__get_items({'sort': 'updatedAt', 'desc': 1, 'limit': self.PAGE_SIZE, 'page': page})
+            results = response.get('results') or []
+            updated = [item.get('updatedAt') or 0 for item in results]
+            if any(later > earlier for earlier, later in zip(updated, updated[1:])):
+                items = self.__fetch_all()
+                return [item for item in items if (item.get('updatedAt') or 0) > self.watermark], items, len(items)
+            for item, updated_at in zip(results, updated):
+                if updated_at <= self.watermark:
+                    return list(changed.values()), None, response.get('total', 0)
+                changed[item.get('id')] = item
+            if len(results) < self.PAGE_SIZE:
+                return list(changed.values()), None, response.get('total', 0)
+            page += 1
+
+    def poll(self) -> int:
+        """
+        Run one sync cycle. Returns the number of add/remove requests sent (or planned on a dry run).
+        """
+        if time.monotonic() - self.collections_loaded > self.COLLECTIONS_REFRESH:
+            # Pick up smart collections created or deleted since the last refresh
+            if self.collections_loaded:
+                self.collections.refresh()
+            self.collections_loaded = time.monotonic()
+
+        if self.watermark is None:
+            self.__load()
+            changed_ids = []
+            removed = []
+        else:
+            changed, items, total = self.__fetch_changed()
+            known = set(self.books.get_ids())
+            removed = []
+            new = sum(1 for item in changed if item.get('id') not in known)
+            if items is not None or total < len(known) + new:
+                # Something was deleted on the server. Deletions are only taken from a listing of
+                # every item in one response, never from pages that may have shifted in between
+                ids = {item.get('id') for item in (items if items is not None else self.__fetch_all())}
+                removed = list(known - ids)
+            if not changed and not removed and not self.pending and all(c.id in self.members for c in self.collections.get_smart()):
+                return 0
+
+            self.books.apply_delta(changed, removed)
+            self.watermark = max([self.watermark] + [item.get('updatedAt') or 0 for item in changed])
+            changed_ids = [item.get('id') for item in changed]
+
+        for members in [*self.members.values(), *self.matched.values()]:
+            members.difference_update(removed)
+
+        # Books from a cycle that failed part way are checked again until a cycle succeeds
+        self.pending = list(dict.fromkeys(self.pending + changed_ids))
+        requests_sent = self.__sync(self.pending)
+        self.pending = []
+        return requests_sent
+
+    def __sync(self, changed_ids: List[str]) -> int:
+        requests_sent = 0
+        all_ids = None
+        for collection in self.collections.get_smart():
+            if collection.id in self.invalid:
+                continue
+            check = changed_ids
+            if collection.id not in self.members:
+                # Not seen before, so every book has to be checked once
+                self.members[collection.id] = set(collection.book_ids)
+                self.matched[collection.id] = set()
+                all_ids = all_ids or self.books.get_ids()
+                check = all_ids
+            members = self.members[collection.id]
+            previously_matched = self.matched[collection.id]
+            changed = set(check)
+            try:
+                matched = set(self.books.match(Collections.query_of(collection), check))
+            except Exception as e:
+                print(f"Collection '{collection.name}': query failed, it will be skipped: {e}", file=sys.stderr)
+                self.invalid.add(collection.id)
+                continue
+
+            added = matched - members
+            removed = (changed & members & previously_matched) - matched if self.remove else set()
+            previously_matched.difference_update(changed - matched)
+            previously_matched.update(matched)
+            if added:
+                if not self.dryrun:
+                    self.collections.add_books(collection.id, sorted(added))
+                members.update(added)
+                requests_sent += 1
+            if removed:
+                if not self.dryrun:
+                    self.collections.remove_books(collection.id, sorted(removed))
+                members.difference_update(removed)
+                requests_sent += 1
+            if added or removed:
+                print(f"Collection '{collection.name}': {len(added)} added, {len(removed)} removed")
+                sys.stdout.flush()
+        return requests_sent
+
+    def run(self, once: bool = False):
+        Watcher.run_all([self], once)
+
+    @staticmethod
+    def run_all(watchers: List['Watcher'], once: bool = False):
+        """
+        Poll every watcher until interrupted, backing off exponentially (up to max_backoff seconds)
+        while the server is failing.
+        """
+        interval = min(watcher.interval for watcher in watchers)
+        max_backoff = max(watcher.max_backoff for watcher in watchers)
+        failures = 0
+        while True:
+            failed = False
+            for watcher in watchers:
+                try:
+                    watcher.poll()
+                except NoBooksException as e:
+                    print(f"{e}", file=sys.stderr)
+                except (ValueError, RestException, requests.exceptions.RequestException) as e:
+                    failed = True
+                    print(f"Error: {e}", file=sys.stderr)
+            failures = failures + 1 if failed else 0
+            if once:
+                return
+            time.sleep(min(interval * (2 ** failures), max_backoff) if failures else interval)
@@ -1,13 +1,79 @@
 import argparse
+import json
+import os
 import shutil
+import socket
 import sys
-from typing import Optional, List
+import time
+from pathlib import Path
+from typing import Optional, List, Dict
+
+_VERSION = "0.0.2"
+
+
+def daemon_socket_path(server: str) -> Path:
+    name = server[:-5] if server.endswith('.json') else server
+    return Path.home() / '.cache' / 'abscli' / f"daemon-{name}.sock"
+
+
+def forward_to_daemon(argv: List[str]) -> Optional[int]:
+    """
+    Run the command in a running 'abscli daemon' for the same server, if there is one.
+
+    Returns the exit code of the command, or None when it has to be run locally.
+    """
+    if os.environ.get('ABSCLI_NO_DAEMON') or 'daemon' in argv:
+        return None
+    # A watch runs until it is stopped, which only works in the client's own process
+    if argv[:1] == ['watch']:
+        return None
+    # Offline commands don't use the server's data the daemon holds
+    if any(arg in ('--offline', '--snapshot') or arg.startswith('--snapshot=') for arg in argv):
+        return None
+
+    server = None
+    for i, arg in enumerate(argv):
+        if arg == '--server' and i + 1 < len(argv):
+            server = argv[i + 1]
+        elif arg.startswith('--server='):
+            server = arg.split('=', 1)[1]
+    if not server:
+        return None
+
+    path = daemon_socket_path(server)
+    if not path.exists():
+        return None
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        try:
+            conn.connect(str(path))
+        except OSError:
+            # A stale socket of a daemon that is gone
+            return None
+        # Once the command is sent it may have run, so it's never run again locally
+        try:
+            conn.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode('utf-8') + b"\n")
+            with conn.makefile('rb') as reader:
+                response = json.loads(reader.readline())
+        except (OSError, ValueError) as e:
+            print(f"Error: Lost the connection to the daemon, the command may not have completed: {e}", file=sys.stderr)
+            return 1
+
+    sys.stdout.write(response.get('stdout', ''))
+    sys.stderr.write(response.get('stderr', ''))
+    return response.get('code', 0)
+
+
+# Hand the command to a warm daemon before paying for the duckdb/pandas imports below
+if __name__ == "__main__":
+    _code = forward_to_daemon(sys.argv[1:])
+    if _code is not None:
+        sys.exit(_code)
 
 from _duckdb import BinderException
 
 from AudioBookShelfClient import *
 
-_VERSION = "0.0.2"
 
 class StripQuotesAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
@@ -18,13 +84,24 @@ class StripQuotesAction(argparse.Action):
         setattr(namespace, self.dest, values)
 
 
+def positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 def main():
     args = setup_parser()
     abscli(args)
 
-def setup_parser():
+def setup_parser(argv: Optional[List[str]] = None):
     common_parser = argparse.ArgumentParser(add_help=False, exit_on_error=True)
     common_parser.add_argument("--server", type=str, required=True, help="Path to config file")
+    common_parser.add_argument("--timings", action='store_true', required=False, help="Report the time taken and the JSON backend used", default=False)
 
     lib_opt_parser = argparse.ArgumentParser(add_help=False, exit_on_error=True, parents=[common_parser])
     lib_opt_parser_lib = lib_opt_parser.add_mutually_exclusive_group(required=False)
@@ -36,47 +113,115 @@ def setup_parser():
     lib_req_parser_lib.add_argument("--library", type=str, help="Name of the library to query")
     lib_req_parser_lib.add_argument("--all", action='store_true', help="Run the command on all libraries")
 
+    paging_parser = argparse.ArgumentParser(add_help=False)
+    paging_group = paging_parser.add_argument_group("paging")
+    paging_group.add_argument("--limit", type=int, required=False, help="Only show the first N books", metavar='N')
+    paging_group.add_argument("--offset", type=int, required=False, help="Skip the first N books", metavar='N')
+    paging_group.add_argument("--after", type=str, required=False, help="Continue after the book with this cursor, printed after a page of results", metavar='SORTKEY,ID')
+
+    offline_parser = argparse.ArgumentParser(add_help=False)
+    offline_group = offline_parser.add_argument_group("offline")
+    offline_group.add_argument("--snapshot", type=str, required=False, help="Read the books from a snapshot saved with 'snapshot save'", metavar='FILE')
+    offline_group.add_argument("--offline", action='store_true', required=False, help="Don't contact the server, use the snapshot and cached responses only", default=False)
+
     parser = argparse.ArgumentParser(description="abscli is an unofficial command line AudioBookShelf API Client", exit_on_error=True)
     parser.add_argument("--version", action="version", version=f"%(prog)s {_VERSION}")
     subparsers = parser.add_subparsers(dest="command")
 
-    list_parser = subparsers.add_parser("list", help="List libraries, series, collections, or books", parents=[lib_opt_parser])
-    list_parser.add_argument("type", type=str, choices=["libraries", "series", "collections", "books", "genres"])
+    list_parser = subparsers.add_parser("list", help="List libraries, series, collections, or books", parents=[lib_opt_parser, paging_parser, offline_parser])
+    list_parser.add_argument("type", type=str, choices=["libraries", "series", "collections", "books", "genres", "authors", "narrators", "tags"])
     list_parser.add_argument("--seperator", type=str, required=False, help="Seperator character(s) used in output", default=None, action=StripQuotesAction)
     list_parser.add_argument("--with-id", action='store_true', required=False, help="Include ID in output (genres do not have an ID)", default=False)
+    list_parser.add_argument("--counts", action='store_true', required=False, help="Include the number of books for series, genres, authors, narrators and tags", default=False)
     filter_group = list_parser.add_argument_group("filter")
     filter_group.add_argument("--filter", type=str, required=False, help="Apply a filter", metavar='VALUE')
     filter_group.add_argument("--exact", action='store_true', required=False, help="Perform an exact match", default=False)
     filter_group.add_argument("--field", type=str, required=False, help="When filtering books, specify the field to match", action=StripQuotesAction)
+    filter_group.add_argument("--ignore-case", action='store_true', required=False, help="Match the filter regardless of case", default=False)
 
     search_parent_parser = argparse.ArgumentParser(parents=[lib_req_parser], add_help=False)
     search_parent_parser_group = search_parent_parser.add_argument_group("searching")
     search_parent_parser_group.add_argument("--where", type=str, required=True, help="SQL Like Where clause", metavar='CLAUSE')
     search_parent_parser_group.add_argument("--sort", type=str, required=False, help="Field to sort results by")
     search_parent_parser_group.add_argument("--direction", type=str, required=False, help="Sort Direction", default="asc", choices=["asc", "desc"])
+    search_parent_parser_group.add_argument("--expand", action='store_true', required=False, help="Add the chapters, audio_files and tracks tables for use in the where clause", default=False)
     search_parent_parser_group.add_argument("--display", type=str, required=False, nargs="+", help="Fields to display", default=None, metavar='COLUMN')
 
-    search_parser = subparsers.add_parser("search", help="Search for books", parents=[search_parent_parser])
+    search_parser = subparsers.add_parser("search", help="Search for books", parents=[search_parent_parser, paging_parser, offline_parser])
 
     create_parser = subparsers.add_parser("create", help="Create a new item", parents=[search_parent_parser])
     create_parser.add_argument("type", type=str, choices=['collection'])
     create_parser.add_argument("--name", type=str, required=True, help="Name of the collection to create")
     create_parser.add_argument("--dryrun", action='store_true', required=False, help="Dry run, do not create the collection", default=False)
+    create_parser.add_argument("--resume", action='store_true', required=False, help="Continue an interrupted run, only sending the books it didn't finish", default=False)
 
     update_parser = subparsers.add_parser("update", help="Update or Create an item", parents=[search_parent_parser])
     update_parser.add_argument("type", type=str, choices=['collection'])
     update_parser.add_argument("--name", type=str, required=True, help="Name of the collection to add the books to")
     update_parser.add_argument("--dryrun", action='store_true', required=False, help="Dry run, do not update the collection", default=False)
+    update_parser.add_argument("--resume", action='store_true', required=False, help="Continue an interrupted run, only sending the books it didn't finish", default=False)
 
     info_parser = subparsers.add_parser("info", help="Get information about the server", parents=[lib_req_parser])
     info_parser.add_argument("type", type=str, choices=["fields"])
 
-    args = parser.parse_args()
+    stats_parser = subparsers.add_parser("stats", help="Show statistics for a library", parents=[lib_req_parser, offline_parser])
+    stats_parser.add_argument("--group-by", type=str, required=False, help=f"Group by {', '.join(Stats.DIMENSIONS)}, or any field or shortcut", metavar='DIMENSION')
+    stats_parser.add_argument("--where", type=str, required=False, help="SQL Like Where clause", metavar='CLAUSE')
+    stats_parser.add_argument("--sort", type=str, required=False, help="Metric to sort groups by", default="books", choices=["name", *Stats.METRICS])
+    stats_parser.add_argument("--expand", action='store_true', required=False, help="Add the chapters, audio_files and tracks tables for use in the where clause", default=False)
+    stats_parser.add_argument("--top", type=int, required=False, help="Only show the first N groups", metavar='N')
+    stats_parser.add_argument("--seperator", type=str, required=False, help="Seperator character(s) used in output", default=None, action=StripQuotesAction)
+
+    dupes_parser = subparsers.add_parser("dupes", help="Find books that are likely to be duplicates", parents=[lib_req_parser])
+    dupes_parser.add_argument("--by", type=str, required=False, nargs="+", help="Checks to run (default all)", default=None, choices=Duplicates.KINDS)
+    dupes_parser.add_argument("--threshold", type=float, required=False, help="Minimum similarity (0-1) of near duplicates", default=0.92)
+    dupes_parser.add_argument("--collection", type=str, required=False, help="Add the duplicates to this collection for review", metavar='NAME')
+    dupes_parser.add_argument("--with-id", action='store_true', required=False, help="Include ID in output", default=False)
+    dupes_parser.add_argument("--dryrun", action='store_true', required=False, help="Dry run, do not update the collection", default=False)
+
+    fix_parser = subparsers.add_parser("fix", help="Update the metadata of the books matching a search", parents=[search_parent_parser])
+    fix_parser.add_argument("--set", type=str, required=False, action="append", default=[], help="Set a field to the value of an SQL expression, e.g. \"_AUTHOR = trim( _AUTHOR )\"", metavar='FIELD=EXPRESSION', dest="assignments")
+    fix_parser.add_argument("--add-tag", type=str, required=False, action="append", default=[], help="Add a tag", metavar='TAG')
+    fix_parser.add_argument("--remove-tag", type=str, required=False, action="append", default=[], help="Remove a tag", metavar='TAG')
+    fix_parser.add_argument("--chunk-size", type=positive_int, required=False, help="Number of books per update request", default=50)
+    fix_parser.add_argument("--concurrency", type=positive_int, required=False, help="Maximum number of update requests in flight", default=4)
+    fix_parser.add_argument("--dryrun", action='store_true', required=False, help="Dry run, show the changes without updating the books", default=False)
+    fix_parser.add_argument("--resume", action='store_true', required=False, help="Continue an interrupted run, only sending the updates it didn't finish", default=False)
+
+    watch_parser = subparsers.add_parser("watch", help="Keep collections created from a search in sync with the library", parents=[lib_req_parser])
+    watch_parser.add_argument("--interval", type=positive_int, required=False, help="Seconds between polls", default=60, metavar='SECONDS')
+    watch_parser.add_argument("--max-backoff", type=positive_int, required=False, help="Longest wait between polls while the server is failing", default=900, metavar='SECONDS')
+    watch_parser.add_argument("--add-only", action='store_true', required=False, help="Never remove books from collections", default=False)
+    watch_parser.add_argument("--once", action='store_true', required=False, help="Run a single sync and exit", default=False)
+    watch_parser.add_argument("--dryrun", action='store_true', required=False, help="Dry run, do not update the collections", default=False)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Save a library's books to a file, or compare two saved files")
+    snapshot_subparsers = snapshot_parser.add_subparsers(dest="action", required=True)
+    snapshot_save_parser = snapshot_subparsers.add_parser("save", help="Save the books of a library as a Parquet snapshot", parents=[lib_req_parser])
+    snapshot_save_parser.add_argument("file", type=str, nargs="?", help="File to write, a directory with --all (default <library>-<date>.parquet)", default=None)
+    snapshot_diff_parser = snapshot_subparsers.add_parser("diff", help="Show the books added, removed and modified between two snapshots")
+    snapshot_diff_parser.add_argument("old", type=str, help="The earlier snapshot")
+    snapshot_diff_parser.add_argument("new", type=str, help="The later snapshot")
+    snapshot_diff_parser.add_argument("--with-id", action='store_true', required=False, help="Include ID in output", default=False)
+    snapshot_diff_parser.add_argument("--seperator", type=str, required=False, help="Seperator character(s) used in output", default=None, action=StripQuotesAction)
+    snapshot_diff_parser.set_defaults(server=None, timings=False)
+
+    daemon_parser = subparsers.add_parser("daemon", help="Keep caches warm and serve commands for a server over a local socket", parents=[common_parser])
+    daemon_parser.add_argument("--refresh", type=positive_int, required=False, help="Seconds between background cache refreshes", default=300, metavar='SECONDS')
+
+    args = parser.parse_args(argv)
     return args
 
 class abscli:
-    def __init__(self, args):
-        self.config = Config(args.server)
+    def __init__(self, args, session: Optional[Session] = None):
+        started = time.perf_counter()
+        # Comparing snapshots needs no server
+        self.config = Config(args.server) if args.server else None
+        JsonDecoder.reset_stats()
+        self.cwd = getattr(args, 'cwd', None)
+        self.snapshot = Snapshots.resolve(getattr(args, 'snapshot', None), self.cwd)
+        if self.config:
+            self.session = session or Session(self.config.url, self.config.api_key, self.snapshot)
         self.libraries = None
         self.collections = None
         self.collections_library_id = None
@@ -87,6 +232,9 @@ class abscli:
         self.filters_library_id = None
 
         try:
+            if self.config:
+                RestClient.configure(http_cache=self.config.http_cache, rate_limit=self.config.rate_limit,
+                                     json_backend=self.config.json_backend, offline=getattr(args, 'offline', False))
             match args.command:
                 case "list":
                     self.perform_list(args)
@@ -98,6 +246,18 @@ class abscli:
                     self.perform_create(args)
                 case "update":
                     self.perform_update(args)
+                case "stats":
+                    self.perform_stats(args)
+                case "dupes":
+                    self.perform_dupes(args)
+                case "fix":
+                    self.perform_fix(args)
+                case "watch":
+                    self.perform_watch(args)
+                case "snapshot":
+                    self.perform_snapshot(args)
+                case "daemon":
+                    self.perform_daemon(args)
         except ValueError as e:
             print(f"Error: {e}", file=sys.stderr)
 #        except AttributeError as e:
@@ -107,9 +267,14 @@ class abscli:
         except BinderException as e:
             print(f"Error: {e}", file=sys.stderr)
 
+        if args.timings:
+            decoded = JsonDecoder.stats()
+            print(f"Timings: {time.perf_counter() - started:.3f}s total; JSON ({JsonDecoder.backend}): "
+                  f"{decoded['responses']} response(s), {decoded['bytes'] / 1e6:.1f} MB decoded in {decoded['seconds']:.3f}s", file=sys.stderr)
+
     def __load_libraries(self):
         if self.libraries is None:
-            self.libraries = Libraries(self.config.url, self.config.api_key)
+            self.libraries = self.session.get_libraries()
 
     def __load_collections(self, library_id: str):
         if library_id and self.collections_library_id != library_id:
@@ -117,7 +282,8 @@ class abscli:
             self.collections_library_id = library_id
 
         if self.collections is None:
-            self.collections = Collections(self.config.url, self.config.api_key, library_id, self.libraries)
+            self.__load_libraries()
+            self.collections = self.session.get_collections(library_id)
 
     def __load_books(self, library_id: str):
         if library_id and self.books_library_id != library_id:
@@ -126,7 +292,7 @@ class abscli:
             self.books_library_id = library_id
 
         if self.books is None:
-            self.books = Books(self.config.url, self.config.api_key, library_id)
+            self.books = self.session.get_books(library_id)
 
     def __load_series(self):
         if self.books is not None and self.series is None:
@@ -138,7 +304,7 @@ class abscli:
             self.filters_library_id = library_id
 
         if self.filters is None:
-            self.filters = Filters(self.config.url, self.config.api_key, library_id)
+            self.filters = self.session.get_filters(library_id)
 
     def perform_list(self, args):
         self.__load_libraries()
@@ -165,14 +331,14 @@ class abscli:
         data = None
         with_id = args.with_id
         fields: Optional[List[str]] = ['name', "id" if with_id else None]
-        filter_field = 'name'
 
         match args.type:
             case "libraries":
                 data = self.libraries.get_all_summary()
-            case "series":
+            case "series" | "genres" | "authors" | "narrators" | "tags":
                 self.__load_filters(library.id)
-                data = self.filters.get_series()
+                data = self.filters.get_list(args.type, with_id, self.__counted_books(library.id) if args.counts else None)
+                fields = ['name', 'books' if args.counts else None, 'id' if with_id else None]
             case "collections":
                 self.__load_collections(library.id if library else None)
                 data = self.collections.get_all_summary()
@@ -180,26 +346,41 @@ class abscli:
                 if not library:
                     fields.insert(1, "library")
             case "books":
+                fields = ['media.metadata.title', 'media.metadata.authorName', "id" if with_id else None]
                 try:
                     self.__load_books(library.id)
-                    data = self.books.get_all()
-                    filter_field = args.field
-                    fields = ['media.metadata.title', 'media.metadata.authorName', "id" if with_id else None]
+                    # Filtered, sorted and paged in DuckDB, only the displayed columns are returned
+                    data = self.books.filter(args.filter, args.field or '_TITLE', args.exact, args.ignore_case,
+                                             [field for field in fields if field], Utils.replace_shortcuts('_TITLE'),
+                                             limit=args.limit, offset=args.offset, after=args.after)
                 except NoBooksException as e:
                     print(f"{e}")
                     return
-            case "genres":
-                self.__load_filters(library.id)
-                data = self.filters.get_genres()
-                fields = ['name']
 
-        if args.filter:
-            data = Utils.apply_filter(data, args.filter, args.exact, filter_field)
+        if args.filter and args.type != "books":
+            data = Utils.apply_filter(data, args.filter, args.exact, 'name', args.ignore_case)
         if data:
             Utils.print(data, fields, args.seperator)
+            if args.type == "books" and args.limit and len(data) == args.limit:
+                self.__print_next_cursor(Utils.replace_shortcuts('_TITLE'), data[-1])
         elif args.all:
             print(f"Library with ID '{library.id}': No matches found")
 
+    def __counted_books(self, library_id: str) -> Optional[Books]:
+        # Counts come from the books table, loading it if this command hasn't already
+        self.__load_books(library_id)
+        try:
+            self.books.load()
+        except NoBooksException:
+            return None
+        return self.books
+
+    def __expand_books(self, args):
+        if args.expand:
+            fetched, cached = self.books.expand()
+            if fetched:
+                print(f"Fetched the chapters, audio files and tracks of {fetched} books ({cached} cached)", file=sys.stderr)
+
     def __do_search(self, args, display: bool = True, library: Optional[Library] = None):
         if not library:
             self.__load_libraries()
@@ -212,8 +393,10 @@ class abscli:
         sort = Utils.replace_shortcuts(args.sort) or Utils.replace_shortcuts('_TITLE')
         if args.display:
             columns = [Utils.replace_shortcuts(item, False) for item in args.display]
+        limit = getattr(args, 'limit', None)
         try:
-            result = self.books.where(where, sort)
+            self.__expand_books(args)
+            result = self.books.where(where, sort, args.direction, limit, getattr(args, 'offset', None), getattr(args, 'after', None))
         except NoBooksException as e:
             print(f"{e}")
             return None, None
@@ -221,11 +404,17 @@ class abscli:
         if result:
             if display:
                 Utils.print(result, columns)
+                if limit and len(result) == limit:
+                    self.__print_next_cursor(sort, result[-1])
             return where, result
         elif display:
             print(f"Library with ID '{library.id}': No matches found")
         return where, None
 
+    def __print_next_cursor(self, order: str, last: Dict):
+        # On stderr, so the listed books can still be piped
+        print(f"Next page: --after '{self.books.next_cursor(order, last)}'", file=sys.stderr)
+
     def perform_search(self, args):
         self.__load_libraries()
         libraries = None
@@ -255,8 +444,13 @@ class abscli:
 
         self.__load_libraries()
         library = self.libraries.get_by_name(args.library)
+        # Collections and books only depend on the library id, fetch them side by side
+        self.session.prefetch(library.id, collections=True, books=True)
         self.__load_collections(library.id)
-        if self.collections.exists(args.name):
+        journal = None if args.dryrun else Journal('create collection', self.config.url, library.id, args.name, resume=args.resume)
+        existing = self.collections.get(args.name)
+        # A collection created by the interrupted run is resumed
+        if existing and not (journal and journal.state.get('collection_id') == existing.id):
             print(f"Error: Collection '{args.name}' already exists", file=sys.stderr)
             sys.exit(2)
         where, items = self.__do_search(args, False)
@@ -264,11 +458,14 @@ class abscli:
             print(f"Error: No books found for collection '{args.name}'", file=sys.stderr)
             return
         try:
-            describe = f"Auto-created by abscli from query: '{where}'"
-            self.collections.create(args.name, describe, library.id, items, dryrun=args.dryrun)
+            describe = Collections.describe(where)
+            self.collections.create(args.name, describe, library.id, items, dryrun=args.dryrun, journal=journal)
         except ValueError as e:
             print(f"Error: {e}", file=sys.stderr)
             sys.exit(1)
+        finally:
+            self.session.invalidate_collections(library.id)
+        self.__finish_journal(journal)
         print(f"Collection '{args.name}' created successfully with the following {len(items)} items:\n")
         Utils.print(items, columns)
 
@@ -279,21 +476,27 @@ class abscli:
 
         self.__load_libraries()
         library = self.libraries.get_by_name(args.library)
+        # Collections and books only depend on the library id, fetch them side by side
+        self.session.prefetch(library.id, collections=True, books=True)
         self.__load_collections(library.id)
         where, items = self.__do_search(args, False)
         if not items or len(items) == 0:
             print(f"Error: No books found for collection '{args.name}'", file=sys.stderr)
             return
 
-        describe = f"Auto-created by abscli from query: '{where}'"
+        describe = Collections.describe(where)
         action = "updated"
+        journal = None if args.dryrun else Journal('update collection', self.config.url, library.id, args.name, resume=args.resume)
         try:
-            updated = self.collections.update(args.name, describe, library.id, items, dryrun=args.dryrun)
+            updated = self.collections.update(args.name, describe, library.id, items, dryrun=args.dryrun, journal=journal)
             if updated and len(updated) == len(items):
                 action = "created"
         except ValueError as e:
             print(f"Error: {e}", file=sys.stderr)
             sys.exit(1)
+        finally:
+            self.session.invalidate_collections(library.id)
+        self.__finish_journal(journal)
         if not updated:
             print(f"Collection '{args.name}' not {action}, no new books were found")
         else:
@@ -310,5 +513,248 @@ class abscli:
             data.insert(1, {'name': '=====', 'shortcut': '============'})
             Utils.print(data, ['name', 'shortcut'])
 
+    def perform_stats(self, args):
+        where = Utils.replace_shortcuts(args.where)
+
+        self.__load_libraries()
+        if args.all:
+            libraries = self.libraries.get_all()
+        else:
+            library = self.libraries.get_by_name(args.library)
+            if not library:
+                print(f"Error: Library '{args.library}' not found", file=sys.stderr)
+                sys.exit(1)
+            libraries = [library]
+
+        fields = ['name', *Stats.METRICS]
+        for library in libraries:
+            if args.all:
+                print(f"\n\nLibrary: {library.name}")
+                print("-" * shutil.get_terminal_size().columns)
+            self.__load_books(library.id)
+            try:
+                self.__expand_books(args)
+                data = Stats(self.books).get(args.group_by, where, args.sort, args.top)
+            except NoBooksException as e:
+                print(f"{e}")
+                continue
+
+            if not args.seperator:
+                data.insert(0, {'name': args.group_by or '', 'books': 'Books', 'hours': 'Hours', 'average': 'Avg Hours', 'size': 'Size (GB)', 'files': 'Files'})
+                data.insert(1, {field: '=' * len(str(data[0][field])) for field in fields})
+            Utils.print(data, fields, args.seperator)
+
+    def perform_dupes(self, args):
+        self.__load_libraries()
+        if args.all:
+            libraries = self.libraries.get_all()
+        else:
+            library = self.libraries.get_by_name(args.library)
+            if not library:
+                print(f"Error: Library '{args.library}' not found", file=sys.stderr)
+                sys.exit(1)
+            libraries = [library]
+
+        fields = ['title', 'author', 'id' if args.with_id else None]
+        for library in libraries:
+            if args.all:
+                print(f"\n\nLibrary: {library.name}")
+                print("-" * shutil.get_terminal_size().columns)
+            self.session.prefetch(library.id, collections=bool(args.collection), books=True)
+            self.__load_books(library.id)
+            try:
+                groups = Duplicates(self.books).find(args.by, args.threshold)
+            except NoBooksException as e:
+                print(f"{e}")
+                continue
+
+            if not groups:
+                print(f"Library with ID '{library.id}': No duplicates found")
+                continue
+
+            for group in groups:
+                label = group['key'] if group['key'] else f"similarity {group['score']}"
+                print(f"\n{group['kind'].upper()}: {label}")
+                Utils.print(group['books'], fields)
+
+            if args.collection:
+                items = list({book['id']: book for group in groups for book in group['books']}.values())
+                self.__load_collections(library.id)
+                try:
+                    added = self.collections.update(args.collection, "Possible duplicates found by abscli", library.id, items, dryrun=args.dryrun)
+                except ValueError as e:
+                    print(f"Error: {e}", file=sys.stderr)
+                    sys.exit(1)
+                self.session.invalidate_collections(library.id)
+                action = "would be added" if args.dryrun else "added"
+                print(f"\n{len(added or [])} books {action} to collection '{args.collection}'")
+
+    @staticmethod
+    def __fix_assignments(args) -> Dict[str, str]:
+        assignments = {}
+        for assignment in args.assignments:
+            if '=' not in assignment:
+                raise ValueError(f"Invalid assignment '{assignment}', expected FIELD=EXPRESSION")
+            field, expression = assignment.split('=', 1)
+            column = Utils.replace_shortcuts(field.strip(), False)
+            Items.check_field(column)
+            assignments[column] = Utils.replace_shortcuts(expression.strip())
+
+        tags = 'media.tags'
+        if args.add_tag or args.remove_tag:
+            expression = assignments.get(tags, f'"{tags}"')
+
+            def literals(values: List[str]) -> str:
+                return '[' + ', '.join("'" + value.replace("'", "''") + "'" for value in dict.fromkeys(values)) + ']::VARCHAR[]'
+
+            # Built once rather than per tag, and without list_distinct so the existing tags keep their order
+            if args.add_tag:
+                expression = (f"list_concat(COALESCE({expression}, []::VARCHAR[]), "
+                              f"list_filter({literals(args.add_tag)}, x -> NOT list_contains(COALESCE({expression}, []::VARCHAR[]), x)))")
+            if args.remove_tag:
+                expression = f"list_filter({expression}, x -> NOT list_contains({literals(args.remove_tag)}, x))"
+            assignments[tags] = expression
+
+        if not assignments:
+            raise ValueError("Nothing to change, use --set, --add-tag or --remove-tag")
+        return assignments
+
+    def perform_fix(self, args):
+        assignments = self.__fix_assignments(args)
+        where = Utils.replace_shortcuts(args.where)
+
+        self.__load_libraries()
+        if args.all:
+            libraries = self.libraries.get_all()
+        else:
+            library = self.libraries.get_by_name(args.library)
+            if not library:
+                print(f"Error: Library '{args.library}' not found", file=sys.stderr)
+                sys.exit(1)
+            libraries = [library]
+
+        items = Items(self.config.url, self.config.api_key)
+        for library in libraries:
+            if args.all:
+                print(f"\n\nLibrary: {library.name}")
+                print("-" * shutil.get_terminal_size().columns)
+            self.__load_books(library.id)
+            try:
+                self.__expand_books(args)
+                diffs = self.books.diff(where, assignments)
+            except NoBooksException as e:
+                print(f"{e}")
+                continue
+
+            if not diffs:
+                print(f"Library with ID '{library.id}': Nothing to change")
+                continue
+
+            for diff in diffs:
+                print(f"{diff['title']} {{{diff['id']}}}")
+                for column, (old, new) in diff['changes'].items():
+                    print(f"    {Utils.find_shortcut(column) or column}: {old} -> {new}")
+
+            if args.dryrun:
+                print(f"\n{len(diffs)} books would be updated")
+                continue
+
+            updates = [{'id': diff['id'], 'mediaPayload': Items.payload({column: new for column, (old, new) in diff['changes'].items()})}
+                       for diff in diffs]
+            journal = Journal('fix', self.config.url, library.id, where, json.dumps(assignments, sort_keys=True), resume=args.resume)
+            try:
+                updated = items.batch_update(updates, chunk_size=args.chunk_size, concurrency=args.concurrency, journal=journal)
+            finally:
+                self.session.invalidate_books(library.id)
+            self.__finish_journal(journal)
+            print(f"\n{updated} books updated")
+
+    @staticmethod
+    def __finish_journal(journal: Optional[Journal]):
+        if journal:
+            if journal.skipped:
+                print(f"Resumed: skipped {journal.skipped} items sent by the interrupted run", file=sys.stderr)
+            journal.finish()
+
+    def perform_watch(self, args):
+        self.__load_libraries()
+        if args.all:
+            libraries = self.libraries.get_all()
+        else:
+            library = self.libraries.get_by_name(args.library)
+            if not library:
+                print(f"Error: Library '{args.library}' not found", file=sys.stderr)
+                sys.exit(1)
+            libraries = [library]
+
+        watchers = [Watcher(self.config.url, self.config.api_key, library.id,
+                            self.session.get_books(library.id), self.session.get_collections(library.id),
+                            interval=args.interval, max_backoff=args.max_backoff, dryrun=args.dryrun,
+                            remove=not args.add_only)
+                    for library in libraries]
+        try:
+            Watcher.run_all(watchers, once=args.once)
+        except KeyboardInterrupt:
+            pass
+
+    def perform_snapshot(self, args):
+        if args.action == "diff":
+            changes = Snapshots.diff(Snapshots.resolve(args.old, self.cwd), Snapshots.resolve(args.new, self.cwd))
+            rows = [{'change': change, **book, 'fields': ', '.join(book.get('fields') or [])}
+                    for change in ('added', 'removed', 'modified') for book in changes[change]]
+            if rows:
+                Utils.print(rows, ['change', 'title', 'author', 'id' if args.with_id else None, 'fields'], args.seperator)
+            print(f"{len(changes['added'])} added, {len(changes['removed'])} removed, {len(changes['modified'])} modified",
+                  file=sys.stderr)
+            return
+
+        self.__load_libraries()
+        if args.all:
+            libraries = self.libraries.get_all()
+        else:
+            library = self.libraries.get_by_name(args.library)
+            if not library:
+                print(f"Error: Library '{args.library}' not found", file=sys.stderr)
+                sys.exit(1)
+            libraries = [library]
+
+        target = Snapshots.resolve(args.file, self.cwd) if args.file else None
+        for library in libraries:
+            name = f"{library.name}-{time.strftime('%Y%m%d-%H%M%S')}.parquet"
+            if args.all:
+                path = (target or Snapshots.resolve('.', self.cwd)) / name
+                path.parent.mkdir(parents=True, exist_ok=True)
+            else:
+                path = target or Snapshots.resolve(name, self.cwd)
+            self.__load_books(library.id)
+            try:
+                count = Snapshots.save(self.books, library, path)
+            except NoBooksException as e:
+                print(f"{e}")
+                continue
+            print(f"Saved {count} books of '{library.name}' to {path}")
+
+    def perform_daemon(self, args):
+        session = self.session
+
+        def handle(argv: List[str], cwd: str) -> int:
+            request = setup_parser(argv)
+            if request.command == "daemon":
+                raise ValueError("The daemon is already running")
+            if getattr(request, 'offline', False) or getattr(request, 'snapshot', None):
+                raise ValueError("Offline and snapshot commands are not run by the daemon")
+            if request.command == "watch":
+                raise ValueError("Watch is not run by the daemon, run it with ABSCLI_NO_DAEMON=1")
+            # Paths on the command line are relative to the client's directory
+            request.cwd = cwd
+            if Config(request.server).url != self.config.url:
+                raise ValueError(f"This daemon serves '{args.server}' only")
+            abscli(request, session)
+            return 0
+
+        path = daemon_socket_path(args.server)
+        print(f"Serving '{args.server}' on {path}", file=sys.stderr)
+        Daemon(path, handle, session.refresh, args.refresh).serve()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
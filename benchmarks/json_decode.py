@@ -0,0 +1,110 @@
+"""
+Compare the JSON backends on a synthetic /api/libraries/{id}/items response.
+
+    python benchmarks/json_decode.py --items 20000 --repeat 5
+"""
+import argparse
+import gc
+import importlib
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from AudioBookShelfClient.collections import _CollectionsResponse
+
+
+def library_item(i: int) -> dict:
+    return {
+        "id": f"li_{i}", "ino": str(1000 + i), "libraryId": "lib_1", "folderId": "fol_1",
+        "path": f"/audiobooks/Author {i % 300}/Book {i}", "relPath": f"Author {i % 300}/Book {i}",
+        "isFile": False, "mtimeMs": 1700000000000 + i, "ctimeMs": 1700000000000, "birthtimeMs": 0,
+        "addedAt": 1700000000000 + i * 1000, "updatedAt": 1700000000000 + i * 1000,
+        "isMissing": False, "isInvalid": False, "mediaType": "book",
+        "media": {
+            "id": f"media_{i}",
+            "metadata": {
+                "title": f"The Book {i}", "titleIgnorePrefix": f"Book {i}, The", "subtitle": None,
+                "authorName": f"Author {i % 300}", "authorNameLF": f"{i % 300}, Author",
+                "narratorName": f"Narrator {i % 120}", "seriesName": f"Series {i % 500} #{i % 7}",
+                "genres": random.sample(["Fantasy", "Science Fiction", "Humor", "Mystery", "History"], 2),
+                "publishedYear": str(1950 + i % 70), "publishedDate": None, "publisher": f"Publisher {i % 40}",
+                "description": "A long description of the book. " * 8, "isbn": None, "asin": f"B0{i:08d}",
+                "language": "English", "explicit": False, "abridged": False,
+            },
+            "coverPath": f"/metadata/items/li_{i}/cover.jpg", "tags": ["imported"],
+            "numTracks": 12, "numAudioFiles": 12, "numChapters": 40,
+            "duration": random.random() * 72000, "size": random.randint(10 ** 7, 10 ** 9), "ebookFormat": None,
+        },
+        "numFiles": 14, "size": random.randint(10 ** 7, 10 ** 9),
+    }
+
+
+def collections_response(count: int) -> dict:
+    books = [library_item(i) for i in range(count)]
+    return {"results": [{"id": f"col_{c}", "name": f"Collection {c}", "libraryId": "lib_1", "description": None,
+                         "books": books[c::10]} for c in range(10)]}
+
+
+def measure(decode: Callable[[bytes], object], body: bytes, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        # Like timeit, keep garbage collection passes out of the measurement
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            decode(body)
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def installed(name: str) -> Optional[object]:
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark JSON decoding of a large library items response")
+    parser.add_argument("--items", type=int, default=20000, help="Number of library items in the response")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per backend, the best is reported")
+    args = parser.parse_args(argv)
+
+    items = json.dumps({"results": [library_item(i) for i in range(args.items)], "total": args.items}).encode('utf-8')
+    collections = json.dumps(collections_response(args.items)).encode('utf-8')
+
+    cases = [
+        ("items", "json (text)", lambda body: json.loads(body.decode('utf-8')), items),
+        ("items", "json (bytes)", json.loads, items),
+    ]
+    orjson = installed('orjson')
+    if orjson:
+        cases.append(("items", "orjson", orjson.loads, items))
+    msgspec = installed('msgspec')
+    if msgspec:
+        cases.append(("items", "msgspec", msgspec.json.decode, items))
+
+    cases.append(("collections", "json (bytes)", json.loads, collections))
+    if orjson:
+        cases.append(("collections", "orjson", orjson.loads, collections))
+    if msgspec:
+        cases.append(("collections", "msgspec (typed)", lambda body: msgspec.json.decode(body, type=_CollectionsResponse), collections))
+
+    print(f"{'response':<12} {'backend':<16} {'MB':>7} {'seconds':>9} {'MB/s':>8}")
+    for response, backend, decode, body in cases:
+        seconds = measure(decode, body, args.repeat)
+        mb = len(body) / 1e6
+        print(f"{response:<12} {backend:<16} {mb:>7.1f} {seconds:>9.4f} {mb / seconds:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()